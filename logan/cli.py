@@ -9,13 +9,10 @@ import sys
 import click
 import glob as glob_lib
 
-import http.server
-import socketserver
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
 from logan._version import __version__
-from logan.log_diagnosis.models.model_zero_shot_classifer import ZeroShotModels
-from logan.log_diagnosis.models import ModelType
-from logan.log_diagnosis.utils import prepare_output_dir
 
 
 class ZeroShotModelType(click.ParamType):
@@ -24,8 +21,18 @@ class ZeroShotModelType(click.ParamType):
     Accepts both ZeroShotModels enum values and custom model name strings.
     """
     name = "model"
+    _models = None
+
+    @classmethod
+    def models(cls):
+        # Imported on first use, so that commands which never load a model do not pay for importing torch
+        if cls._models is None:
+            from logan.log_diagnosis.models.model_zero_shot_classifer import ZeroShotModels
+            cls._models = ZeroShotModels
+        return cls._models
 
     def convert(self, value, param, ctx):
+        ZeroShotModels = self.models()
         if value is None:
             return ZeroShotModels.CROSSENCODER
         
@@ -51,8 +58,18 @@ class ZeroShotModelType(click.ParamType):
 class ModelTypeChoice(click.ParamType):
     """Custom click parameter type for ModelType enum."""
     name = "model_type"
+    _model_types = None
+
+    @classmethod
+    def model_types(cls):
+        # Imported on first use, since the models package pulls in torch and transformers
+        if cls._model_types is None:
+            from logan.log_diagnosis.models import ModelType
+            cls._model_types = ModelType
+        return cls._model_types
 
     def convert(self, value, param, ctx):
+        ModelType = self.model_types()
         if value is None:
             return ModelType.ZERO_SHOT
         
@@ -152,6 +169,26 @@ def cli():
     show_default=True,
     help="Model to use for classification. Built-in options: bart, crossencoder. Or specify a custom HuggingFace model name."
 )
+@click.option(
+    "--preprocessing-workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of processes used to preprocess the logs. Defaults to the number of CPUs."
+)
+@click.option(
+    "--drain-workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of processes used for Drain3 template mining. Values above 1 mine contiguous shards of the logs in parallel and merge their templates."
+)
+@click.option(
+    "--report-format",
+    type=click.Choice(["json", "parquet"]),
+    default="json",
+    show_default=True,
+    help="Format of the anomaly data chunks. The HTML anomaly report loads json chunks and is only written for them; parquet chunks are smaller and faster to write for use in other tools."
+)
 @click.option(
     "--clean-up",
     is_flag=True,
@@ -159,7 +196,7 @@ def cli():
     help="Clean up the output directory if it already exists."
 )
 def analyze(files, glob, time_range, output_dir, debug_mode, process_all_files, process_log_files, 
-            process_txt_files, model_type, model, clean_up):
+            process_txt_files, model_type, model, preprocessing_workers, drain_workers, report_format, clean_up):
     """
     Analyze log files for anomalies.
     
@@ -201,18 +238,21 @@ def analyze(files, glob, time_range, output_dir, debug_mode, process_all_files,
     click.echo(f"  Process only .txt files: {process_txt_files}")
     click.echo(f"  Model type: {model_type}")
     click.echo(f"  Model: {model}")
+    click.echo(f"  Preprocessing workers: {preprocessing_workers or os.cpu_count()}")
+    click.echo(f"  Drain workers: {drain_workers}")
+    click.echo(f"  Report format: {report_format}")
     click.echo(f"  Clean up: {clean_up}")
     click.echo()
     
-    files = list(files)
-    if glob:
-        files.extend(glob_lib.glob(glob))
+    # Merge the explicit files with the glob matches, dropping paths that were given more than once
+    files = list(dict.fromkeys([*files, *(glob_lib.iglob(glob, recursive=True) if glob else [])]))
     
     if len(files) == 0:
         click.echo(click.style("No log files found. Please provide input files or use a glob pattern.", fg="red", bold=True))
         sys.exit(1)
     
     # Prepare output directory
+    from logan.log_diagnosis.utils import prepare_output_dir
     click.echo(click.style("Step 0: Preparing output directory...", fg="cyan"))
     prepare_output_dir(output_dir, clean_up)
     
@@ -223,7 +263,7 @@ def analyze(files, glob, time_range, output_dir, debug_mode, process_all_files,
     
     # Step 1: Preprocessing
     click.echo(click.style("\nStep 1: Preprocessing log files...", fg="cyan"))
-    preprocessing_obj = Preprocessing(debug_mode_str)
+    preprocessing_obj = Preprocessing(debug_mode_str, num_workers=preprocessing_workers)
     preprocessing_obj.preprocess(
         files,
         time_range,
@@ -242,7 +282,7 @@ def analyze(files, glob, time_range, output_dir, debug_mode, process_all_files,
     # Step 2: Template generation
     click.echo(click.style("\nStep 2: Generating log templates...", fg="cyan"))
     drain_config_path = os.path.join(os.path.dirname(__file__), 'drain', 'drain3.ini')
-    templatizer = Templatizer(debug_mode=debug_mode_str, config_path=drain_config_path)
+    templatizer = Templatizer(debug_mode=debug_mode_str, config_path=drain_config_path, num_workers=drain_workers)
     templatizer.miner(
         preprocessing_obj.df,
         output_dir,
@@ -255,13 +295,17 @@ def analyze(files, glob, time_range, output_dir, debug_mode, process_all_files,
     anomaly_obj = Anomaly(debug_mode_str, model_type, model)
     anomaly_obj.get_anomaly_report(
         templatizer.df,
-        output_dir
+        output_dir,
+        report_format
     )
     
     click.echo(click.style("\n" + "=" * 50, fg="green"))
     click.echo(click.style("Analysis complete!", fg="green", bold=True))
     click.echo(f"\nOutput files:")
-    click.echo(f"  Anomaly report: {os.path.join(output_dir, 'log_diagnosis', 'anomalies.html')}")
+    if report_format == "parquet":
+        click.echo(f"  Anomaly data: {os.path.join(output_dir, 'developer_debug_files', 'data_*.parquet')}")
+    else:
+        click.echo(f"  Anomaly report: {os.path.join(output_dir, 'log_diagnosis', 'anomalies.html')}")
     click.echo(f"  Summary report: {os.path.join(output_dir, 'log_diagnosis', 'summary.html')}")
 
 
@@ -289,9 +333,11 @@ def view(port, dir):
     After running the command, visit http://localhost:PORT/OUTPUT_DIR/log_diagnosis/ in your browser
     to view the anomaly and summary reports.
     """
-    Handler = http.server.SimpleHTTPRequestHandler
+    # Serve the current directory with a thread per request, so that the report's data chunks and assets
+    # are fetched concurrently and a lingering keep-alive connection does not block other requests
+    Handler = partial(SimpleHTTPRequestHandler, directory=os.path.abspath('.'))
 
-    with socketserver.TCPServer(("", port), Handler) as httpd:
+    with ThreadingHTTPServer(("", port), Handler) as httpd:
         try:
             click.echo(f"⚠️  Note: This log analysis report contains AI classified results.\n\t Please make sure to manually review the report before taking any action.\n\n")
 
@@ -1,12 +1,99 @@
 import logging
 import sys
 import os
-import json
 import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from drain3.drain import LogCluster
 from drain3.template_miner import TemplateMiner
 from drain3.template_miner_config import TemplateMinerConfig
 from drain3.file_persistence import FilePersistence
 
+from logan.json_utils import write_json_file
+
+
+def iter_cluster_ids(template_miner, logs):
+    """
+    Runs the DRAIN3 template miner over log messages and lazily yields the cluster ID of each message.
+
+    Messages are masked and passed to the DRAIN tree directly instead of going through
+    `TemplateMiner.add_log_message`, which builds a result dictionary, records profiler sections and
+    snapshots the whole tree to the persistence handler on every template change. The caller is
+    responsible for saving the template miner state once mining is done.
+
+    Logs are highly repetitive, so the cluster of a message that no longer changes the DRAIN tree is
+    remembered and its duplicates skip the tree traversal. A duplicate still counts towards the size of its
+    cluster and refreshes it in the cluster cache, as DRAIN does when it matches a message. A remembered
+    cluster that has been evicted from the cache is forgotten and the message goes through DRAIN again.
+
+    Args:
+        template_miner (TemplateMiner): The template miner used to learn the templates.
+        logs (iterable): Log messages to mine, e.g. a list of strings or an open file.
+
+    Yields:
+        int: The cluster ID assigned to each log message.
+    """
+    mask = template_miner.masker.mask
+    drain = template_miner.drain
+    add_log_message = drain.add_log_message
+    id_to_cluster = drain.id_to_cluster
+
+    cluster_cache = {}
+    for log in logs:
+        cluster = cluster_cache.get(log)
+        if cluster is not None:
+            if cluster.cluster_id in id_to_cluster:
+                cluster.size += 1
+                # Touch the cluster to update its state in the cache of clusters
+                id_to_cluster[cluster.cluster_id]
+                yield cluster.cluster_id
+                continue
+            del cluster_cache[log]
+
+        cluster, change_type = add_log_message(mask(log))
+        if change_type == 'none':
+            cluster_cache[log] = cluster
+        yield cluster.cluster_id
+
+
+def mine_cluster_ids(template_miner, logs):
+    """
+    Runs the DRAIN3 template miner over a list of log messages and returns the cluster ID of each message.
+
+    Args:
+        template_miner (TemplateMiner): The template miner used to learn the templates.
+        logs (list): Log messages to mine.
+
+    Returns:
+        list: The cluster ID assigned to each log message.
+    """
+    return list(iter_cluster_ids(template_miner, logs))
+
+
+def mine_shard(config_path, logs):
+    """
+    Mines templates for one shard of the logs with its own in-memory DRAIN3 template miner.
+
+    Args:
+        config_path (str): The path to the DRAIN3 configuration file.
+        logs (list): Log messages of the shard.
+
+    Returns:
+        tuple: The shard-local cluster ID of each log message, and a mapping of
+               shard-local cluster ID to (template tokens, cluster size).
+    """
+    config = TemplateMinerConfig()
+    config.load(config_path)
+    template_miner = TemplateMiner(None, config)
+
+    test_ids = mine_cluster_ids(template_miner, logs)
+    clusters = {
+        cluster.cluster_id: (cluster.log_template_tokens, cluster.size)
+        for cluster in template_miner.drain.clusters
+    }
+    return test_ids, clusters
+
+
 class Templatizer:
     """
     The Templatizer class is responsible for mining log templates using the DRAIN3 algorithm.
@@ -24,15 +111,24 @@ class Templatizer:
         
         miner(df, output_dir, template):
             Mines log templates from the given DataFrame and saves the templates to a specified path.
+
+        miner_stream(log_iter, output_dir, template):
+            Mines log templates from a stream of log messages and returns the cluster IDs as an array.
+
+        mine_sharded(template_miner, logs):
+            Mines log templates for contiguous shards of the logs in parallel and merges them into the template miner.
     """
     
-    def __init__(self, config_path: str = "/Drain3/run_drain/drain3.ini", debug_mode: str = False):
+    def __init__(self, config_path: str = "/Drain3/run_drain/drain3.ini", debug_mode: str = False, num_workers: int = 1):
         """
         Initializes the Templatizer with logging and a configuration path for the DRAIN3 miner.
         
         Args:
             config_path (str): The path to the DRAIN3 configuration file. Defaults to '/Drain3/run_drain/drain3.ini'.
             debug_mode (str): Flag to enable debug mode for additional logging and file saving. Defaults to False.
+            num_workers (int): Number of processes used to mine templates. With more than one worker the logs are
+                split into contiguous shards that are mined independently and whose templates are merged afterwards.
+                Defaults to 1.
         """
         # Setup logging to output messages to stdout with INFO level
         logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
@@ -47,6 +143,9 @@ class Templatizer:
 
         # Debug mode flag
         self.debug_mode = debug_mode
+
+        # Number of processes used for template mining
+        self.num_workers = max(1, int(num_workers))
     
     def compute_drain_statistics(self, time_taken: float, output_dir: str):
         """
@@ -56,15 +155,102 @@ class Templatizer:
             time_taken (float): The time taken for the template mining process, in seconds.
             output_dir (str): The directory where the statistics will be saved.
         """
-        # Dictionary to store the time taken for the DRAIN3 mining process
-        metrics = {
-            'drain_templatisation_time_ms': time_taken
-        }
-
-        # Save the metrics as a JSON file in the specified output directory
+        # Save the time taken for the DRAIN3 mining process as a JSON file in the specified output directory.
+        # The document has a single numeric key, so it is composed directly instead of going through json.
         with open(os.path.join(output_dir, "metrics", "drain.json"), 'w') as writer:
-            writer.write(json.dumps(metrics, indent=4))
+            writer.write(f'{{\n    "drain_templatisation_time_ms": {float(time_taken)!r}\n}}')
     
+    def mine_sharded(self, template_miner, logs):
+        """
+        Mines log templates for contiguous shards of the logs in separate processes and merges the results.
+        
+        Templates learned by different shards are merged by their token sequence and inserted into the
+        given template miner, whose state is then saved once.
+
+        Args:
+            template_miner (TemplateMiner): The template miner that receives the merged templates.
+            logs (list): Log messages to mine.
+
+        Returns:
+            list: The merged cluster ID assigned to each log message.
+        """
+        shard_size = -(-len(logs) // self.num_workers)
+        shards = [logs[start:start + shard_size] for start in range(0, len(logs), shard_size)]
+        self.logger.info(f"Mining templates for {len(shards)} shards with {self.num_workers} workers")
+
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            results = list(executor.map(mine_shard, [self.config_path] * len(shards), shards))
+
+        drain = template_miner.drain
+        template_to_cluster = {cluster.log_template_tokens: cluster for cluster in drain.clusters}
+
+        test_ids = []
+        for shard_test_ids, shard_clusters in results:
+            # Map the shard-local cluster IDs to the merged clusters, creating the ones not seen yet
+            cluster_id_map = {}
+            for local_cluster_id, (template_tokens, size) in shard_clusters.items():
+                cluster = template_to_cluster.get(template_tokens)
+                if cluster is None:
+                    drain.clusters_counter += 1
+                    cluster = LogCluster(template_tokens, drain.clusters_counter)
+                    cluster.size = 0
+                    drain.id_to_cluster[cluster.cluster_id] = cluster
+                    drain.add_seq_to_prefix_tree(drain.root_node, cluster)
+                    template_to_cluster[template_tokens] = cluster
+                cluster.size += size
+                cluster_id_map[local_cluster_id] = cluster.cluster_id
+            test_ids.extend(cluster_id_map[cluster_id] for cluster_id in shard_test_ids)
+
+        if template_miner.persistence_handler is not None:
+            template_miner.save_state("sharded_templates_merged")
+
+        return test_ids
+
+    def create_template_miner(self, template: str):
+        """
+        Creates a DRAIN3 template miner that persists the learned templates to the given file.
+
+        Args:
+            template (str): The file path where the mined templates will be stored.
+
+        Returns:
+            TemplateMiner: The configured template miner.
+        """
+        # Load the DRAIN3 configuration from the specified path
+        config = TemplateMinerConfig()
+        config.load(self.config_path)
+
+        # Set up file persistence to store the learned templates in the specified template file
+        mem_persistence = FilePersistence(template)
+        
+        # Initialize the TemplateMiner with the loaded configuration and file persistence
+        return TemplateMiner(mem_persistence, config)
+
+    def miner_stream(self, log_iter, output_dir: str, template: str):
+        """
+        Apply the DRAIN3 template mining algorithm to a stream of log messages.
+        
+        Unlike `miner`, no DataFrame has to be resident: log messages are consumed one at a time, so callers
+        can pass a generator or an open file, and only the cluster IDs are kept in memory.
+
+        Args:
+            log_iter (iterable): Log messages to mine.
+            output_dir (str): The directory where output files, such as statistics, will be saved.
+            template (str): The file path where the mined templates will be stored.
+
+        Returns:
+            np.ndarray: The cluster ID assigned to each log message, as an int32 array.
+        """
+        start_time = time.time()
+        self.logger.info("Starting DRAIN")
+
+        template_miner = self.create_template_miner(template)
+        test_ids = np.fromiter(iter_cluster_ids(template_miner, log_iter), dtype=np.int32)
+        template_miner.save_state("templates_mined")
+
+        self.compute_drain_statistics((time.time() - start_time) * 1000, output_dir)
+        return test_ids
+
     def miner(self, df, output_dir: str, template: str):
         """
         Apply the DRAIN3 template mining algorithm to the given DataFrame.
@@ -81,30 +267,24 @@ class Templatizer:
         start_time = time.time()
         self.logger.info("Starting DRAIN")
 
-        # Load the DRAIN3 configuration from the specified path
-        config = TemplateMinerConfig()
-        config.load(self.config_path)
-
-        # Set up file persistence to store the learned templates in the specified template file
-        mem_persistence = FilePersistence(template)
-        
-        # Initialize the TemplateMiner with the loaded configuration and file persistence
-        template_miner_temporary = TemplateMiner(mem_persistence, config)
+        template_miner_temporary = self.create_template_miner(template)
 
         # Initialize a dictionary to store the loglines grouped by template IDs
         template_log_dict = {}
 
         # Attempt to mine templates by applying DRAIN to each log message in the DataFrame
         try:
-            # Apply the template miner to the 'truncated_log' column and assign the resulting cluster ID
-            df["test_ids"] = df.apply(
-                lambda row: template_miner_temporary.add_log_message(row["truncated_log"])['cluster_id'],
-                axis=1
-            )
+            # Apply the template miner to the 'truncated_log' column and assign the resulting cluster ID.
+            # A plain loop over the column values avoids building a pandas Series for every row.
+            logs = df["truncated_log"].tolist()
+            if self.num_workers > 1 and len(logs) > self.num_workers:
+                df["test_ids"] = self.mine_sharded(template_miner_temporary, logs)
+            else:
+                df["test_ids"] = mine_cluster_ids(template_miner_temporary, logs)
+                template_miner_temporary.save_state("templates_mined")
             if (self.debug_mode == "true"):
                 template_log_dict = df.groupby("test_ids")["truncated_log"].agg(list).to_dict()
-                with open(os.path.join(output_dir, "developer_debug_files", "matcher_output_json.json"), 'w') as json_file:
-                    json.dump(template_log_dict, json_file, indent=4)
+                write_json_file(template_log_dict, os.path.join(output_dir, "developer_debug_files", "matcher_output_json.json"))
 
         except Exception as e:
             # Log any errors encountered during the mining process
@@ -0,0 +1,51 @@
+"""
+JSON helpers shared by the pipeline stages.
+
+This module only depends on the standard library and the optional orjson package, so that importing it does
+not pull in the dependencies of any stage.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def load_json(text):
+    """
+    Decodes a json document with orjson when it is installed, which is considerably faster than json.
+    Documents that orjson rejects, e.g. with NaN values, are decoded with json.
+
+    Args:
+        text (str or bytes): The json document.
+
+    Returns:
+        The decoded object.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def write_json_file(obj, file_path):
+    """
+    Serializes an object to JSON and writes it to a file in a single call.
+
+    Uses orjson when it is installed, which is considerably faster for the large debug dumps,
+    and falls back to the standard library json module otherwise. Both write UTF-8 with an indentation of 2.
+
+    Args:
+        obj (dict or list): The JSON serializable object to write.
+        file_path (str): Path of the output JSON file.
+    """
+    if orjson is not None:
+        with open(file_path, 'wb') as writer:
+            writer.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(file_path, 'w', encoding='utf-8') as writer:
+            writer.write(json.dumps(obj, indent=2, ensure_ascii=False))
@@ -1,10 +1,10 @@
 import os
-import json
+import numpy as np
 import pandas as pd
 import time
 import csv
 from .core import Core
-from datetime import datetime
+from logan.json_utils import write_json_file
 from logan.log_diagnosis.utils import get_anomaly_html_str, get_summary_html_str
 from logan.log_diagnosis.models import ModelManager, AllModels, ModelType
 
@@ -17,6 +17,7 @@ class Anomaly(Core):
         - `find_supersets_and_subsets_`: Merges similar TID tuples by identifying supersets and subsets.
         - `merge_sim_windows`: Merges consecutive log windows with similar characteristics.
         - `epoch_to_str`: Converts epoch timestamps to human-readable strings.
+        - `epochs_to_str`: Converts a sequence of epoch timestamps to human-readable strings in bulk.
         - `get_anomaly_report`: Generates an anomaly report by processing log data and saving the results in HTML format.
 
     Attributes:
@@ -48,44 +49,42 @@ class Anomaly(Core):
         Returns:
             dict: A dictionary where subsets are merged into supersets, ensuring minimal redundant entries.
         """
-        superset_dict = {}
-
-        for error_tid_tuple, elements in input_superset_dict.items():
-
-            # If superset_dict is empty, add the first error TID tuple and elements
-            if len(superset_dict) == 0:
-                superset_dict[error_tid_tuple] = elements
-                continue
-
-            merged_flag = False
-            # Iterate through existing supersets to find any that can be merged
-            for key_tup in list(superset_dict.keys()):
-                superset = set(key_tup)
-
-                # Check if the current error_tid_tuple is a subset or superset of an existing key
-                if superset.issuperset(set(error_tid_tuple)):
-                    superset_dict[key_tup].extend(elements)
-                    merged_flag = True
-                    break
-                elif set(error_tid_tuple).issuperset(superset):
-                    superset_dict[error_tid_tuple] = superset_dict.pop(key_tup)
-                    superset_dict[error_tid_tuple].extend(elements)
-                    merged_flag = True
-                    break
-
-            # If no merging occurred, add the new entry to the dictionary
-            if not merged_flag:
-                try:
-                    if elements not in superset_dict[error_tid_tuple]:
-                        superset_dict[error_tid_tuple] = elements
-                except KeyError:
-                    superset_dict[error_tid_tuple] = elements
-
-        # If input_superset_dict has different size than superset_dict, repeat the merging process
-        if len(input_superset_dict) != len(superset_dict):
-            superset_dict = self.find_supersets_and_subsets_(superset_dict)
-        
-        return superset_dict
+        # Build the set of TIDs of every tuple once, and reuse it for the vocabulary and the bitmask
+        tid_sets = {error_tid_tuple: frozenset(error_tid_tuple) for error_tid_tuple in input_superset_dict}
+
+        # Encode each error TID set as a bitmask over the TID vocabulary so that subset checks are integer operations
+        vocab = {tid: i for i, tid in enumerate(sorted(frozenset().union(*tid_sets.values())))}
+        masks = {
+            error_tid_tuple: sum(1 << vocab[tid] for tid in tid_set)
+            for error_tid_tuple, tid_set in tid_sets.items()
+        }
+
+        # Visit the tuples in input (chronological) order. A tuple joins the first group in the dictionary whose key
+        # contains it, or takes over the first group whose key it contains, moving it to the end under its own key.
+        # Passes are repeated until no group is merged, as subsets can outlive the pass that created their superset
+        items = [(error_tid_tuple, masks[error_tid_tuple], elements) for error_tid_tuple, elements in input_superset_dict.items()]
+        while True:
+            groups = {}
+            for error_tid_tuple, mask, elements in items:
+                for key_tup, (key_mask, key_elements) in groups.items():
+                    if (mask & key_mask) in (mask, key_mask):
+                        break
+                else:
+                    # No comparable group found, the tuple starts a new group
+                    groups[error_tid_tuple] = (mask, list(elements))
+                    continue
+
+                key_elements.extend(elements)
+                if mask & key_mask != mask:
+                    # The tuple contains the key of the group, so it takes the group over
+                    del groups[key_tup]
+                    groups[error_tid_tuple] = (mask, key_elements)
+
+            if len(groups) == len(items):
+                break
+            items = [(key_tup, key_mask, key_elements) for key_tup, (key_mask, key_elements) in groups.items()]
+
+        return {key_tup: key_elements for key_tup, (_, key_elements) in groups.items()}
 
     def merge_sim_windows(self, df):
         """
@@ -97,17 +96,15 @@ class Anomaly(Core):
         Returns:
             pd.DataFrame: A DataFrame where similar windows have been merged, containing columns for start and end epochs, logs, file names, and TIDs.
         """
-        # Extract necessary data from DataFrame columns into lists
-        epochs = df["epoch"].to_list()
-        logs_lists = [logs_string.split("\n") for logs_string in df["text_output"].to_list()]
-        file_names_lists = [file_names_string.split("\n") for file_names_string in df["file_names"].to_list()]
-        error_tids_lists = [[tid for tid in test_ids.split(" ") if tid != "info"] for test_ids in df["error_test_ids"].to_list()]
-        tids_lists = [test_ids.split(" ") for test_ids in df["test_ids"].to_list()]
-
-        # Initialize superset dictionary with tuples of error TIDs
-        superset_dict = {tuple(error_tids_list): [(tids_list, logs_list, file_names_list, epoch, error_tids_list)] 
-                         for tids_list, logs_list, file_names_list, epoch, error_tids_list 
-                         in zip(tids_lists, logs_lists, file_names_lists, epochs, error_tids_lists)}
+        # Build the superset dictionary keyed by tuples of error TIDs in a single pass over the rows
+        superset_dict = {}
+        columns = ["epoch", "text_output", "file_names", "error_test_ids", "test_ids"]
+        for epoch, text_output, file_names, error_test_ids, test_ids in df[columns].itertuples(index=False, name=None):
+            logs_list = text_output.split("\n")
+            file_names_list = file_names.split("\n")
+            tids_list = test_ids.split(" ")
+            error_tids_list = [tid for tid in error_test_ids.split(" ") if tid != "info"]
+            superset_dict.setdefault(tuple(error_tids_list), []).append((tids_list, logs_list, file_names_list, epoch, error_tids_list))
 
         # Find and merge supersets and subsets within the data
         superset_dict = self.find_supersets_and_subsets_(superset_dict)
@@ -133,13 +130,15 @@ class Anomaly(Core):
             [error_tids.extend(sublist[4]) for sublist in elements]
 
             # Build concatenated strings for TIDs, logs, and file names
-            first_indices = [(item, index) for index, item in enumerate(tids)]
+            tid_parts, log_parts, file_parts = [], [], []
+            for index, tid in enumerate(tids):
+                tid_parts.append(tid)
+                log_parts.append(logs[index])
+                file_parts.append(file_names[index])
 
-            tid_str, log_str, file_str = "", "", ""
-            for tid, index in first_indices:
-                tid_str += " " + tid
-                log_str += "\n" + logs[index]
-                file_str += "\n" + file_names[index]
+            tid_str = " ".join(tid_parts)
+            log_str = "\n".join(log_parts)
+            file_str = "\n".join(file_parts)
 
             # Remove duplicates and format the strings
             error_tids = set(error_tids)
@@ -184,38 +183,53 @@ class Anomaly(Core):
         Returns:
             str: A string representing the GMT time in 'YYYY-MM-DD HH:MM:SS' format.
         """
-        # Convert epoch to UTC datetime object
-        gmt_time = datetime.utcfromtimestamp(epoch)
-
-        # Format datetime object as a string in GMT timezone
-        gmt_time_string = gmt_time.strftime('%Y-%m-%d %H:%M:%S')
+        # Format the UTC struct_time directly, without building an intermediate datetime object
+        gmt_time_string = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch))
 
         return gmt_time_string
 
+    def epochs_to_str(self, epochs):
+        """
+        Converts a sequence of epoch timestamps to human-readable GMT time strings in a single vectorized call.
+        
+        Args:
+            epochs (list): Epoch times in seconds.
+        
+        Returns:
+            list: Strings representing the GMT times in 'YYYY-MM-DD HH:MM:SS' format.
+        """
+        return pd.to_datetime(np.asarray(epochs, dtype=float), unit='s', utc=True).strftime('%Y-%m-%d %H:%M:%S').tolist()
+
     def compute_anomaly_statistics(self, output_dir, time):
+        # The document has a single numeric key, so it is composed directly instead of going through json
         with open(os.path.join(output_dir, "metrics", "anomaly.json"), 'w') as writer:
-            data = {
-                'anomaly_detection_time_ms': time,
-            }
-            writer.write(json.dumps(data, indent=4))
+            writer.write(f'{{\n    "anomaly_detection_time_ms": {float(time)!r}\n}}')
 
-    def get_anomaly_report(self, df_inference_csv, output_dir):
+    def get_anomaly_report(self, df_inference_csv, output_dir, report_format='json'):
         """
         Generates an anomaly report from the input DataFrame, processes it for anomalies, merges similar windows,
         and saves the results in HTML format for both anomalies and summary reports.
         
         Args:
             df_inference_csv (pd.DataFrame): The input data containing log information to process.
-            output_file (str): Output file path for saving the anomaly HTML report.
-            debug_file (str): Debug file path for storing intermediate files.
+            output_dir (str): Output directory; reports are saved under 'log_diagnosis' and intermediate files under 'developer_debug_files'.
+            report_format (str): Format of the anomaly data chunks, 'json' or 'parquet'. The anomaly HTML report
+                is only written for 'json' chunks. Defaults to 'json'.
         
         Returns:
             None
         """
         print("Output directory:", output_dir)
 
+        # Resolve all input and output paths once
         log_diagnosis_dir = os.path.join(output_dir, "log_diagnosis")
         developer_debug_dir = os.path.join(output_dir, "developer_debug_files")
+        anomalies_html_path = os.path.join(log_diagnosis_dir, "anomalies.html")
+        summary_html_path = os.path.join(log_diagnosis_dir, "summary.html")
+        ignored_files_path = os.path.join(developer_debug_dir, "ignored_files.log")
+        processed_files_path = os.path.join(developer_debug_dir, "processed_files.log")
+        rep_log_debug_path = os.path.join(developer_debug_dir, "temp_id_to_rep_log.json")
+        signal_map_debug_path = os.path.join(developer_debug_dir, "temp_id_to_signal_map.json")
 
         start = time.time()
 
@@ -241,25 +255,24 @@ class Anomaly(Core):
         print("ended the preprocessing of input data")
         
         # Log template and signal map debug files
-        debug_file_path = os.path.join(developer_debug_dir, "temp_id_to_rep_log.json")  
         if (self.debug_mode == "true"):
-            with open(debug_file_path, 'w') as writer:
-                json.dump(temp_id_to_rep_log, writer, indent=4) 
-        json_serializable_map = {str(k): v for k, v in temp_id_to_signal_map.items()}
-        debug_file_path = os.path.join(developer_debug_dir, "temp_id_to_signal_map.json") 
-        if (self.debug_mode == "true"):
-            with open(debug_file_path, 'w') as writer:
-                json.dump(json_serializable_map, writer, indent=4)
+            write_json_file(temp_id_to_rep_log, rep_log_debug_path)
+            # Tuple keys are not valid JSON keys, so they are stringified first
+            json_serializable_map = {str(k): v for k, v in temp_id_to_signal_map.items()}
+            write_json_file(json_serializable_map, signal_map_debug_path)
         
+        # Compute the 'information only' window mask once and reuse it for both selections
+        all_info_mask = df_for_anomaly_html["all_info"].to_numpy(dtype=bool)
+
         # Process logs with only 'information' golden signals
-        all_info_df = df_for_anomaly_html[df_for_anomaly_html.all_info == True]
+        all_info_df = df_for_anomaly_html[all_info_mask]
         start_ts_all_info = all_info_df["epoch"].tolist()
         template_ids2_all_info = all_info_df["test_ids"].tolist()
         log_seq_all_info = all_info_df["text_output"].tolist()
 
         # Convert start and end epochs to readable strings
-        end_ts_all_info = [self.epoch_to_str(ts + 30) for ts in start_ts_all_info]
-        start_ts_all_info = [self.epoch_to_str(ts) for ts in start_ts_all_info]
+        end_ts_all_info = self.epochs_to_str(np.asarray(start_ts_all_info, dtype=float) + 30)
+        start_ts_all_info = self.epochs_to_str(start_ts_all_info)
 
         # Create a DataFrame for the 'all information' windows
         df_all_info = pd.DataFrame.from_dict({
@@ -272,7 +285,7 @@ class Anomaly(Core):
         normal_win_count = len(log_seq_all_info)
 
         # Process logs for anomalies (non-information golden signals)
-        df_final_anomalies = df_for_anomaly_html[df_for_anomaly_html.all_info != True]
+        df_final_anomalies = df_for_anomaly_html[~all_info_mask]
         df_final_anomalies = self.merge_sim_windows(df_final_anomalies)
 
         # Extract and sort start/end times, logs, file names, and templates for the anomalies
@@ -282,9 +295,15 @@ class Anomaly(Core):
         log_seq = df_final_anomalies["text_output"].tolist()
         file_seq = df_final_anomalies["file_names"].tolist()
         if len(log_seq) != 0:
-            start_ts, end_ts, template_ids2, log_seq, file_seq = zip(*sorted(zip(start_ts, end_ts, template_ids2, log_seq, file_seq), reverse=True))
-            end_ts = [self.epoch_to_str(ts) for ts in end_ts]
-            start_ts = [self.epoch_to_str(ts) for ts in start_ts]
+            # Sort on the epochs only, so ties never fall back to comparing the large log strings
+            order = sorted(range(len(start_ts)), key=lambda i: (start_ts[i], end_ts[i]), reverse=True)
+            start_ts = [start_ts[i] for i in order]
+            end_ts = [end_ts[i] for i in order]
+            template_ids2 = [template_ids2[i] for i in order]
+            log_seq = [log_seq[i] for i in order]
+            file_seq = [file_seq[i] for i in order]
+            end_ts = self.epochs_to_str(end_ts)
+            start_ts = self.epochs_to_str(start_ts)
 
         print(f"total normal windows: {normal_win_count}")
         print(f"total anomalous windows: {len(log_seq)}")  
@@ -300,21 +319,26 @@ class Anomaly(Core):
             'list_templates': template_ids2
         })
 
-        # Read debug information (ignored and processed files)
-        with open(os.path.join(developer_debug_dir, "ignored_files.log"), 'r') as reader:
-            ignored_files = reader.read().splitlines()
+        # Read debug information (ignored and processed files). Preprocessing writes them "\n"-joined,
+        # so a plain split is enough; the lists are kept as is since the summary template slices them in order.
+        with open(ignored_files_path, 'r') as reader:
+            content = reader.read()
+            ignored_files = content.split('\n') if content else []
 
-        with open(os.path.join(developer_debug_dir, "processed_files.log"), 'r') as reader:
-            processsed_files = reader.read().splitlines()
+        with open(processed_files_path, 'r') as reader:
+            content = reader.read()
+            processsed_files = content.split('\n') if content else []
         
-        # Generate the HTML table for the anomaly report
-        html_table = get_anomaly_html_str(df_final_anomalies, output_dir)
-        with open(os.path.join(log_diagnosis_dir, "anomalies.html"), "w") as f:
-            f.write(html_table)
+        # Generate the HTML table for the anomaly report, writing its data chunks in this process.
+        # Parquet chunks are meant for other tools, the HTML report is only written for JSON chunks.
+        html_table = get_anomaly_html_str(df_final_anomalies, output_dir, report_format=report_format)
+        if html_table is not None:
+            with open(anomalies_html_path, "w") as f:
+                f.write(html_table)
 
         # Generate the HTML table for the summary report
         html_table = get_summary_html_str(df_for_summary_html, include_golden_signal_dropdown=True, ignored_file_list=ignored_files, processed_file_list=processsed_files, output_dir=output_dir)
-        with open(os.path.join(log_diagnosis_dir, "summary.html"), "w") as f:
+        with open(summary_html_path, "w") as f:
             f.write(html_table)
 
         self.compute_anomaly_statistics(output_dir, (time.time() - start) * 1000)
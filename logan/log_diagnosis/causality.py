@@ -1,13 +1,15 @@
+import heapq
 import json
+import os
 from argparse import ArgumentParser
-from datetime import timedelta
-from itertools import combinations
-from statsmodels.tsa.stattools import grangercausalitytests
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import chi2
 import csv
 from jinja2 import Template
 
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 
 
@@ -17,51 +19,173 @@ arg_parser.add_argument('--product_name', help='Product name for which tool is r
 arg_parser.add_argument('--signal_map', help='Template ID to Golden Signal and Fault Category map')
 arg_parser.add_argument('--template_map', help='Template ID to Template string')
 arg_parser.add_argument('--output_file', help='Output HTML File for Casuality')
+arg_parser.add_argument('--num_workers', type=int, default=None, help='Number of processes for Granger causality tests (defaults to all cores)')
+arg_parser.add_argument('--min_correlation', type=float, default=0, help='Skip the Granger causality test of pairs whose peak lagged correlation is below this value (defaults to 0, testing every pair)')
 args = arg_parser.parse_args()
 
-def run_granger_causality(timeseries, top_k):
-    results = {}
-
-    template_pairs = combinations(timeseries.keys(), 2)
-
-    for template_pair in template_pairs:
-        template1, template2 = template_pair
-
-        # Make the time series stationary by differencing
-        differenced_series1 = np.diff(timeseries[template1])
-        differenced_series2 = np.diff(timeseries[template2])
-
-        # Check for constant columns in differenced_series1 and differenced_series2
-        if np.unique(differenced_series1).size == 1 or np.unique(differenced_series2).size == 1:
-            continue
- 
-        data = pd.DataFrame({'Template1': differenced_series1, 'Template2': differenced_series2})
-        
-        try:
-            result = grangercausalitytests(data, maxlag=5, verbose=False)
-        except InfeasibleTestError:
-            # Handle cases where the test statistic cannot be computed
-            continue
-        except ValueError as e:
-            # Handle other potential errors
-            print(f"Error occurred: {e}")
-            continue
-        # Check if Granger causality exists (p-value is below threshold, e.g., 0.05)
-        granger_exists = any(result[lag][0]['ssr_chi2test'][1] < 0.05 for lag in result.keys())
-
-        if granger_exists:
-            results[template_pair] = result
-
-    # Sort the results based on the p-values in ascending order
-    sorted_results = sorted(results.items(), key=lambda x: np.min([x[1][lag][0]['ssr_chi2test'][1] for lag in x[1].keys()]))
-
-    # Select the top K pairs
-    top_k_results = dict(sorted_results[:top_k])
+# Differenced time series and candidate pairs shared with the Granger causality worker processes
+granger_series = None
+granger_candidates = None
+
+def init_granger_worker(series, candidates):
+    global granger_series, granger_candidates
+    granger_series = series
+    granger_candidates = candidates
+
+def lag_matrix(series, lag):
+    # Columns series[t-1], ..., series[t-lag] for t = lag .. n-1, for one series or a stack of series.
+    # This is a read-only view on the series, no lagged copies are made
+    return sliding_window_view(series[..., :-1], lag, axis=-1)[..., ::-1]
+
+def granger_tests(target, partners, maxlag=5):
+    """
+    Runs the SSR based chi2 Granger causality test of each partner series on the target series.
+
+    This computes the same statistic as the 'ssr_chi2test' of statsmodels' `grangercausalitytests`,
+    for all partners at once. The regression on the lags of the target (and a constant) does not depend on
+    the partner, so it is solved once per lag; the lags of each partner are then regressed on its residuals
+    (Frisch-Waugh), which gives the residuals of the joint regression for the whole stack of partners.
+
+    Args:
+        target (np.ndarray): Differenced series of the caused template.
+        partners (np.ndarray): Differenced series of the candidate causing templates, one per row.
+        maxlag (int): The maximum number of lags to test.
+
+    Returns:
+        tuple: The chi2 statistics and p-values, each of shape (number of partners, maxlag).
+               Rows are NaN where the test is infeasible, as when statsmodels raises InfeasibleTestError.
+    """
+    stats = np.full((len(partners), maxlag), np.nan)
+    pvalues = np.full((len(partners), maxlag), np.nan)
+    feasible = np.ones(len(partners), dtype=bool)
+
+    for lag in range(1, maxlag + 1):
+        y = target[lag:]
+        own_lags = lag_matrix(target, lag)
+        partner_lags = lag_matrix(partners, lag)
+
+        # A constant lagged column or a constant target makes the test infeasible
+        tss = np.sum((y - y.mean()) ** 2)
+        if tss == 0 or (np.ptp(own_lags, axis=0) == 0).any():
+            feasible[:] = False
+            break
+        feasible &= ~(np.ptp(partner_lags, axis=1) == 0).any(axis=1)
+
+        # Restricted model: lags of the target and a constant
+        restricted = np.column_stack((own_lags, np.ones(len(y))))
+        restricted_pinv = np.linalg.pinv(restricted)
+        residuals = y - restricted @ (restricted_pinv @ y)
+        ssr_restricted = residuals @ residuals
+
+        # Joint model: additionally the lags of the partner, after projecting out the restricted regressors
+        partner_lags = partner_lags - restricted @ (restricted_pinv @ partner_lags)
+        coefficients = np.linalg.pinv(partner_lags) @ residuals
+        joint_residuals = residuals - np.einsum('pml,pl->pm', partner_lags, coefficients)
+        ssr_joint = np.einsum('pm,pm->p', joint_residuals, joint_residuals)
+
+        # A perfect fit of the joint model makes the test infeasible
+        with np.errstate(divide='ignore', invalid='ignore'):
+            feasible &= (ssr_joint != 0) & (ssr_joint / tss >= np.finfo(float).eps)
+            stats[:, lag - 1] = len(y) * (ssr_restricted - ssr_joint) / ssr_joint
+        pvalues[:, lag - 1] = chi2.sf(stats[:, lag - 1], lag)
+
+    stats[~feasible] = np.nan
+    pvalues[~feasible] = np.nan
+    return stats, pvalues
+
+def lagged_correlations(series, maxlag=5):
+    """
+    Computes the peak absolute lagged correlation between all pairs of series.
+
+    Args:
+        series (np.ndarray): Time series, one per row.
+        maxlag (int): The maximum lag to consider.
+
+    Returns:
+        np.ndarray: Matrix whose entry (i, j) is the largest |corr(series[i][t], series[j][t - lag])| over lags 1 .. maxlag.
+    """
+    standardized = (series - series.mean(axis=1, keepdims=True)) / series.std(axis=1, keepdims=True)
+    n = standardized.shape[1]
+
+    peak = np.zeros((len(series), len(series)))
+    for lag in range(1, maxlag + 1):
+        np.maximum(peak, np.abs(standardized[:, lag:] @ standardized[:, :-lag].T) / n, out=peak)
+    return peak
+
+def run_granger_row(row, maxlag=5):
+    # Tests whether the candidate series after `row` Granger-cause the series at `row`
+    partner_rows = row + 1 + np.flatnonzero(granger_candidates[row, row + 1:])
+    stats, pvalues = granger_tests(granger_series[row], granger_series[partner_rows], maxlag)
+    return partner_rows, stats, pvalues
+
+def run_granger_causality(timeseries, top_k, num_workers=None, maxlag=5, min_correlation=0):
+    if not timeseries:
+        return {}
+
+    # Make the time series stationary by differencing, once for all templates
+    templates = list(timeseries.keys())
+    differenced = np.ascontiguousarray(np.diff(np.asarray(list(timeseries.values()), dtype=np.float64), axis=1))
+
+    # Pairs with a constant differenced series are skipped, so drop those templates up front
+    is_constant = np.ptp(differenced, axis=1) == 0
+    templates = [template for row, template in enumerate(templates) if not is_constant[row]]
+    differenced = differenced[~is_constant]
+
+    if len(templates) < 2:
+        return {}
+
+    if differenced.shape[1] <= 3 * maxlag + 1:
+        print(f"Error occurred: Insufficient observations. Maximum allowable lag is {int((differenced.shape[1] - 1) / 3) - 1}")
+        return {}
+
+    # Optionally screen out the pairs whose lagged correlation is below min_correlation. This is a heuristic that
+    # can change the reported pairs: the test conditions on the target's own lags, so a pair with a low marginal
+    # correlation may still have a small p-value. It is off by default
+    if min_correlation > 0:
+        candidates = lagged_correlations(differenced, maxlag) >= min_correlation
+    else:
+        candidates = np.ones((len(templates), len(templates)), dtype=bool)
+
+    # Each row is tested against the candidate rows after it. The rows are independent, so they are tested
+    # in parallel; map keeps the row order
+    rows = range(len(templates) - 1)
+    maxlags = [maxlag] * len(rows)
+    num_workers = num_workers or os.cpu_count() or 1
+    if num_workers == 1:
+        init_granger_worker(differenced, candidates)
+        row_results = list(map(run_granger_row, rows, maxlags))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=init_granger_worker, initargs=(differenced, candidates)) as executor:
+            row_results = list(executor.map(run_granger_row, rows, maxlags))
+
+    # Keep the K pairs with the smallest p-values in a bounded heap. Its smallest entry is the worst kept pair:
+    # the largest p-value and, among equal p-values, the pair found last, as a stable sort would order them
+    top_k_heap = []
+    num_found = 0
+    for row, (partner_rows, stats, pvalues) in zip(rows, row_results):
+        for offset, partner_row in enumerate(partner_rows):
+            # Check if Granger causality exists (p-value is below threshold, e.g., 0.05)
+            if not (pvalues[offset] < 0.05).any() or top_k <= 0:
+                continue
+
+            entry = (-pvalues[offset].min(), -num_found, row, partner_row, offset)
+            num_found += 1
+            if len(top_k_heap) < top_k:
+                heapq.heappush(top_k_heap, entry)
+            else:
+                heapq.heappushpop(top_k_heap, entry)
+
+    # Select the top K pairs, sorted based on the p-values in ascending order
+    top_k_results = {}
+    for _, _, row, partner_row, offset in sorted(top_k_heap, reverse=True):
+        stats, pvalues = row_results[row][1:]
+        top_k_results[(templates[row], templates[partner_row])] = {
+            lag: {'ssr_chi2test': (stats[offset, lag - 1], pvalues[offset, lag - 1], lag)}
+            for lag in range(1, maxlag + 1)
+        }
 
     return top_k_results
 
-from datetime import timedelta
-
 def create_timeseries(df):
     df = df.sort_values('timestamp')
     total_duration = df['timestamp'].iloc[-1] - df['timestamp'].iloc[0]
@@ -74,26 +198,40 @@ def create_timeseries(df):
     # Calculate window size based on the stride duration
     window_size = stride_duration * 5
 
-    timeseries = {}
-    start_time = df['timestamp'].iloc[0]
-    end_time = start_time + window_size
-    while end_time <= df['timestamp'].iloc[-1]:
-        window = df[(df['timestamp'] >= start_time) & (df['timestamp'] < end_time)]
-
-        template_counts = window['template'].value_counts().to_dict()
-
-        for template in df['template'].unique():
-            count = template_counts.get(template, 0)
-            if template not in timeseries:
-                timeseries[template] = []
-            timeseries[template].append(count)
-
-        start_time += timedelta(seconds=stride)
-        end_time = start_time + window_size
-
-    for template in list(timeseries.keys()):
-        if sum(timeseries[template]) == 0 or len(set(timeseries[template])) <= 3:
-            del timeseries[template]
+    # Work on integer nanosecond offsets from the first timestamp. Windows start every `stride` seconds
+    # and are kept while they end before the last timestamp. A stride below one second falls back to
+    # the exact stride duration; with no time span at all there is no window to count.
+    offsets = df['timestamp'].to_numpy(dtype='datetime64[ns]').view('i8')
+    offsets = offsets - offsets[0]
+    stride_ns = stride * 10**9 or stride_duration.value
+    window_ns = window_size.value
+    if stride_ns <= 0 or offsets[-1] < window_ns:
+        return {}
+    num_windows = (offsets[-1] - window_ns) // stride_ns + 1
+
+    # A log line at offset d falls in window k when k * stride <= d < k * stride + window_size, i.e. in a
+    # contiguous range of windows. Mark the range boundaries per template and integrate them with a
+    # cumulative sum to obtain every window count in one pass, instead of filtering the frame per window.
+    template_idx, templates = pd.factorize(df['template'])
+    first_window = np.maximum((offsets - window_ns) // stride_ns + 1, 0)
+    last_window = np.minimum(offsets // stride_ns, num_windows - 1)
+    in_range = first_window <= last_window
+
+    counts = np.zeros((len(templates), num_windows + 1), dtype=np.int32)
+    np.add.at(counts, (template_idx[in_range], first_window[in_range]), 1)
+    np.add.at(counts, (template_idx[in_range], last_window[in_range] + 1), -1)
+    counts = np.cumsum(counts[:, :-1], axis=1, dtype=np.int32)
+
+    # Keep the templates that occur and take more than three distinct counts over the windows
+    sorted_counts = np.sort(counts, axis=1)
+    num_distinct = (np.diff(sorted_counts, axis=1) != 0).sum(axis=1) + 1
+    keep = (counts.sum(axis=1) != 0) & (num_distinct > 3)
+
+    timeseries = {
+        template: counts[i]
+        for i, template in enumerate(templates)
+        if keep[i]
+    }
 
     return timeseries
 
@@ -109,7 +247,7 @@ def filter_using_gs(inferencing_file, template_to_signal_dict):
     return df[df.gs != 'information']
 
 #Window size is in seconds
-def get_causal_pairs(inferencing_file, template_to_signal_dict, window_size=3600, stride = 900, top_k=10):
+def get_causal_pairs(inferencing_file, template_to_signal_dict, window_size=3600, stride = 900, top_k=10, num_workers=None, min_correlation=0):
     causal_pairs = []
 
     df_timestamp_template = filter_using_gs(inferencing_file, template_to_signal_dict)
@@ -117,7 +255,7 @@ def get_causal_pairs(inferencing_file, template_to_signal_dict, window_size=3600
 
     print('Started timeseries creation')
     timeseries = create_timeseries(df_timestamp_template) #, window_size, stride)
-    causality_results = run_granger_causality(timeseries, top_k)
+    causality_results = run_granger_causality(timeseries, top_k, num_workers, min_correlation=min_correlation)
 
     print('Causality over')
     for key, value in causality_results.items():
@@ -167,10 +305,22 @@ def run_temporal_evolution(inferencing_file, template_to_signal_file, num_rows=3
     # Calculate window size based on desired number of rows
     window_size = total_duration / num_rows
 
-    df_count = pd.get_dummies(df['gs']).resample(f'{window_size.seconds}S').sum()
-    df_count = df_count.reset_index()
-    df_count['start_time'] = df_count['timestamp'].astype(str)
-    df_count.drop('timestamp', axis=1, inplace=True)
+    # Count the golden signals per window. Windows are aligned to midnight of the first day and empty
+    # windows between the first and last log are kept, as with resample
+    # The window is rounded down to whole seconds as with resample, and kept to at least one second for logs
+    # spanning less than num_rows seconds, which resample rejected
+    window_ns = max(1, int(window_size.total_seconds())) * 10**9
+    origin = df.index.min().floor('D')
+    window_idx = (df.index.asi8 - origin.value) // window_ns
+    first_window = window_idx.min()
+    gs_codes, gs_names = pd.factorize(df['gs'], sort=True)
+
+    counts = np.zeros((window_idx.max() - first_window + 1, len(gs_names)), dtype=np.int64)
+    np.add.at(counts, (window_idx - first_window, gs_codes), 1)
+
+    df_count = pd.DataFrame(counts, columns=gs_names)
+    start_times = origin + pd.to_timedelta((first_window + np.arange(len(counts))) * window_ns, unit='ns')
+    df_count['start_time'] = start_times.astype(str)
 
     return {
         'data': df_count.to_dict('records'),
@@ -178,7 +328,7 @@ def run_temporal_evolution(inferencing_file, template_to_signal_file, num_rows=3
         'status': 'success'
     }
 
-def run_causality(inferencing_file, template_to_signal_file, template_map):
+def run_causality(inferencing_file, template_to_signal_file, template_map, num_workers=None, min_correlation=0):
     # start_time_post = time.time()
 
     with open(template_to_signal_file, 'r') as reader:
@@ -191,12 +341,12 @@ def run_causality(inferencing_file, template_to_signal_file, template_map):
         template_to_rep_log = {int(id): log for id, log in json.load(reader).items()}
 
     #Run Causality
-    causal_pairs = get_causal_pairs(inferencing_file, template_to_signal_dict)
+    causal_pairs = get_causal_pairs(inferencing_file, template_to_signal_dict, num_workers=num_workers, min_correlation=min_correlation)
     
     #Create nodes and edges
     nodes_arr = []
     edges_arr = []
-    node_ids_already = []
+    node_ids_already = set()
 
     for pair in causal_pairs:
         src = int(pair[0])
@@ -205,14 +355,14 @@ def run_causality(inferencing_file, template_to_signal_file, template_map):
         if src not in node_ids_already:
             gs = template_to_signal_dict[src]
             node_src = {'id': src, 'label': template_to_rep_log[src], 'gs': gs}
-            node_ids_already.append(src)
+            node_ids_already.add(src)
             nodes_arr.append(node_src)
     
         if trgt not in node_ids_already:
             gs = template_to_signal_dict[trgt]
             node_trgt = {'id': trgt, 'label': template_to_rep_log[trgt], 'gs': gs}
     
-            node_ids_already.append(trgt)
+            node_ids_already.add(trgt)
             nodes_arr.append(node_trgt)
     
         edge = {'source':src, 'target':trgt}
@@ -231,15 +381,14 @@ def render_template(graph, bar_chart):
         html = reader.read()
 
     html_template = Template(html)
-    rendered_template = html_template.render(graph_nodes=graph['Nodes'], graph_edges=graph['Edges'], temporal_evolution=bar_chart, title=f'{args.product_name}_Causality')
-    
-    with open(f'{args.output_file}', 'w') as writer:
-        writer.write(rendered_template)
+
+    # Stream the rendered chunks straight to the output file instead of building the whole HTML string first
+    html_template.stream(graph_nodes=graph['Nodes'], graph_edges=graph['Edges'], temporal_evolution=bar_chart, title=f'{args.product_name}_Causality').dump(args.output_file)
     
 
 if __name__ == "__main__":
     # print(run_causality(args.input_file, args.signal_map))
-    graph = run_causality(args.input_file, args.signal_map, args.template_map)
+    graph = run_causality(args.input_file, args.signal_map, args.template_map, args.num_workers, args.min_correlation)
     bar_chart = run_temporal_evolution(args.input_file, args.signal_map)
     
     render_template(graph, bar_chart)
\ No newline at end of file
@@ -6,7 +6,6 @@ from dateutil import parser as god_parse
 from dateutil import tz
 import pandas as pd
 import statistics
-from pandarallel import pandarallel
 from tqdm import tqdm
 from transformers import pipeline
 from transformers.pipelines.pt_utils import KeyDataset
@@ -14,9 +13,7 @@ from datasets import Dataset
 
 from logan.log_diagnosis.models import ModelManager, AllModels, ModelType
 
-pandarallel.initialize(progress_bar=False)
 tqdm.pandas()
-np.random.seed(42)
 
 class Core:
     """
@@ -26,8 +23,8 @@ class Core:
     Uses zero-shot classification to categorize logs into: Info, Error, Network, Availability.
 
     Methods:
-        backprop_gs_fault_with_temp_ids(row, mapping):
-            Determines the golden signal and fault categories for each log entry based on template IDs and mapping.
+        backprop_gs_fault_with_temp_ids(df, mapping):
+            Determines the golden signal and fault categories for all log entries based on template IDs and mapping.
 
         convert_to_epoch(timestamp_str, format):
             Converts a timestamp string to an epoch timestamp.
@@ -35,6 +32,9 @@ class Core:
         epoch_to_str(epoch, format):
             Converts an epoch timestamp to a formatted string.
 
+        classify_unique_logs(classify, list_of_logs, batch_size):
+            Classifies each distinct log once and maps the predictions back to all logs.
+
         get_fault(list_logs, model_fault, batch_size):
             Detects fault categories in the provided log data using zero-shot classification.
 
@@ -47,6 +47,9 @@ class Core:
         select_first_item(lst):
             Selects first item from a list of logs and returns it in a list
 
+        aggregate_windows(df, rows, window_codes, windows):
+            Aggregates the log entries of each window into a single row for the anomaly report.
+
         process_data(df_inference_csv, model_gs, model_fault, batch_size):
             Processes the input DataFrame to detect golden signals and fault categories using zero-shot classification, and generates dataframe for summary and anomaly reports.
     """
@@ -57,29 +60,45 @@ class Core:
         """
         self.model_manager = ModelManager(type, model)
 
-    def backprop_gs_fault_with_temp_ids(self, row, mapping):
+    def backprop_gs_fault_with_temp_ids(self, df, mapping):
         """
-        Determines the golden signal and fault categories for a log entry based on its template ID and file name.
+        Determines the golden signal and fault categories for all log entries based on their template ID and file name.
+
+        The mapping holds one entry per (template ID, file name), so the labels are resolved once per entry and
+        looked up for all rows at once instead of calling Python for each row. Logs without a template
+        (test_ids == -1) are labelled Info with the 'other' fault category.
         
         Args:
-            row (pd.Series): A row from the DataFrame containing the log details.
+            df (pd.DataFrame): DataFrame containing the log details in 'test_ids', 'file_names' and 'text' columns.
             mapping (dict): A mapping of (template_id, file_name) to (golden_signal, fault_categories).
 
         Returns:
-            pd.Series: A series containing the golden signal and the formatted log string with fault categories.
+            tuple: A tuple containing:
+                - np.ndarray: The golden signal of each log entry.
+                - pd.Series: The formatted log string with fault categories of each log entry.
+
+        Raises:
+            KeyError: If a log with a template has no entry in the mapping.
         """
-        templateId_new = row["test_ids"]
-        file_name = row["file_names"]
-        log = row["text"]
-        
-        if templateId_new == -1:
-            gs, fault = "Info", [["other"]]
-        else:
-            gs, fault = mapping[(templateId_new, file_name)]
-
-        log = log.replace("\n", "&#13;&#10;")
-        out_string = f"{log} => Fault-Categories: {fault[0]} => Golden-Signal: {gs}"
-        return pd.Series([gs, out_string])
+        # Logs without a template have no golden signal
+        mapping_gs = [gs for gs, _ in mapping.values()] + ["Info"]
+        mapping_fault = [str(fault[0]) for _, fault in mapping.values()] + [str(["other"])]
+
+        keys = pd.MultiIndex.from_arrays([df["test_ids"], df["file_names"]])
+        positions = pd.MultiIndex.from_tuples(list(mapping.keys()), names=keys.names).get_indexer(keys) if mapping else np.full(len(df), -1)
+        # Every templated log must have an entry, as with a direct lookup of its key
+        untemplated = (df["test_ids"] == -1).to_numpy()
+        missing = np.flatnonzero((positions == -1) & ~untemplated)
+        if len(missing):
+            raise KeyError((df["test_ids"].iat[missing[0]], df["file_names"].iat[missing[0]]))
+        positions[untemplated] = len(mapping)
+
+        gs = np.asarray(mapping_gs, dtype=object)[positions]
+        fault = np.asarray(mapping_fault, dtype=object)[positions]
+
+        logs = df["text"].str.replace("\n", "&#13;&#10;", regex=False)
+        out_strings = logs + " => Fault-Categories: " + fault + " => Golden-Signal: " + gs
+        return gs, out_strings
     
     def convert_to_epoch(self, timestamp_str, format):
         """
@@ -118,6 +137,29 @@ class Core:
         time_string = dt_object.strftime(format)
         return time_string
 
+    def classify_unique_logs(self, classify, list_of_logs, batch_size):
+        """
+        Classifies each distinct log once and maps the predictions back to all logs.
+
+        Representative logs of different templates and files often share the same preprocessed text, so
+        running the classifier on the distinct logs only saves model forward passes.
+
+        Args:
+            classify (callable): Classification function of the model manager, e.g. `classify_golden_signal`.
+            list_of_logs (list): Log entries to classify.
+            batch_size (int): The batch size for processing logs.
+
+        Returns:
+            list: The prediction for each log entry, in the order of `list_of_logs`.
+        """
+        unique_logs = list(dict.fromkeys(list_of_logs))
+        unique_predictions = classify(unique_logs, batch_size)
+        if len(unique_logs) == len(list_of_logs):
+            return unique_predictions
+
+        prediction_by_log = dict(zip(unique_logs, unique_predictions))
+        return [prediction_by_log[log] for log in list_of_logs]
+
     def get_fault(self, list_logs, model_fault=None, batch_size=32):
         """
         Detects fault categories in the provided logs using zero-shot classification.
@@ -142,7 +184,7 @@ class Core:
             list_of_logs.extend(logs)
 
         # Initialize zero-shot classification pipeline
-        predictions = self.model_manager.classify_fault_category(list_of_logs, batch_size)
+        predictions = self.classify_unique_logs(self.model_manager.classify_fault_category, list_of_logs, batch_size)
 
         # Extract predictions with confidence threshold
         fault_predictions = []
@@ -169,33 +211,50 @@ class Core:
         Returns:
             list: The final class for each log entry, determined by weighted average and tie-breaking rules.
         """
-        final_output = []
-        
-        for fopr, fcpr in zip(final_outputs_per_rep, final_scores_per_rep):
+        if not final_outputs_per_rep:
+            return []
+
+        # Flatten the predictions of all reps, keeping the index of the template ID each rep belongs to
+        groups = np.repeat(np.arange(len(final_outputs_per_rep)), [len(fopr) for fopr in final_outputs_per_rep])
+        class_ids, classes = pd.factorize(np.asarray([cls for fopr in final_outputs_per_rep for cls in fopr], dtype=object))
+        scores = np.asarray([score for fcpr in final_scores_per_rep for score in fcpr], dtype=np.float64)
+
+        # Sum the scores and count the predictions of each class per template ID
+        score_sums = np.zeros((len(final_outputs_per_rep), len(classes)))
+        class_counts = np.zeros((len(final_outputs_per_rep), len(classes)), dtype=np.int64)
+        np.add.at(score_sums, (groups, class_ids), scores)
+        np.add.at(class_counts, (groups, class_ids), 1)
+
+        # Find the class with the highest average score; classes not predicted for a template ID never win
+        with np.errstate(divide='ignore', invalid='ignore'):
+            class_avg_scores = np.where(class_counts > 0, score_sums / class_counts, -np.inf)
+        final_output = classes[class_avg_scores.argmax(axis=1)].tolist()
+
+        # Template IDs whose best averages are tied up to floating point rounding are resolved exactly below
+        near_best = np.isclose(class_avg_scores, class_avg_scores.max(axis=1, keepdims=True), rtol=1e-9, atol=0)
+        for group in np.flatnonzero(near_best.sum(axis=1) > 1):
+            fopr, fcpr = final_outputs_per_rep[group], final_scores_per_rep[group]
+
             # Combine the predicted classes and scores into a dictionary
             class_scores = {}
             for cls, score in zip(fopr, fcpr):
-                class_scores.setdefault(cls, {'sum': 0, 'count': 0, 'score': []})
-                class_scores[cls]['sum'] += score
-                class_scores[cls]['count'] += 1
-                class_scores[cls]['score'].append(score)
-            
+                class_scores.setdefault(cls, []).append(score)
+
             # Calculate the average score for each class
-            class_avg_scores = {cls: statistics.mean(values['score']) for cls, values in class_scores.items()}
-            
+            class_avg_score = {cls: statistics.mean(cls_scores) for cls, cls_scores in class_scores.items()}
+
             # Find the class with the highest average score
-            max_avg_score = max(class_avg_scores.values())
-            best_classes = [cls for cls, avg_score in class_avg_scores.items() if avg_score == max_avg_score]
+            max_avg_score = max(class_avg_score.values())
+            best_classes = [cls for cls, avg_score in class_avg_score.items() if avg_score == max_avg_score]
             
             # If there are ties in average score, find the class with the highest count
             if len(best_classes) > 1:
-                max_count = max(class_scores[cls]['count'] for cls in best_classes)
-                best_classes = [cls for cls in best_classes if class_scores[cls]['count'] == max_count]
+                max_count = max(len(class_scores[cls]) for cls in best_classes)
+                best_classes = [cls for cls in best_classes if len(class_scores[cls]) == max_count]
             
-            # If there are still ties, randomly select a class
-            final_class = np.random.choice(best_classes)
+            # If there are still ties, select the class predicted first
+            final_output[group] = best_classes[0]
 
-            final_output.append(final_class)
         return final_output
 
     def get_gs(self, list_logs, model_gs=None, batch_size=32):
@@ -228,7 +287,7 @@ class Core:
             list_of_logs.extend(logs)
 
         # Initialize zero-shot classification pipeline
-        predictions = self.model_manager.classify_golden_signal(list_of_logs, batch_size)
+        predictions = self.classify_unique_logs(self.model_manager.classify_golden_signal, list_of_logs, batch_size)
         print(f"Predictions: {predictions[0]}")
 
         output = [pred['labels'][0] for pred in predictions]  # Get the top prediction
@@ -244,6 +303,35 @@ class Core:
     def select_first_item(self, lst):
         return [lst.iloc[0]]
 
+    def aggregate_windows(self, df, rows, window_codes, windows):
+        """
+        Aggregates the log entries of each window into a single row for the anomaly report.
+
+        Args:
+            df (pd.DataFrame): DataFrame with 'test_ids', 'error_test_ids', 'file_names', 'text_output', 'epoch' and 'golden_signal' columns.
+            rows (np.ndarray): Positions of the rows to aggregate, sorted by window and in log order within a window.
+            window_codes (np.ndarray): Index into `windows` of the window of each row of `df`.
+            windows (pd.Index): The sorted window values.
+
+        Returns:
+            pd.DataFrame: One row per window with the joined values of its log entries, the epoch of its first
+                          log entry and the number of log entries ('len').
+        """
+        row_codes = window_codes[rows]
+        starts = np.flatnonzero(np.diff(row_codes, prepend=-1))
+        bounds = list(zip(starts.tolist(), np.append(starts[1:], len(rows)).tolist()))
+
+        df_windows = pd.DataFrame({'group': windows[row_codes[starts]]})
+        for column, separator in (('test_ids', ' '), ('error_test_ids', ' '), ('file_names', '\n'), ('text_output', '\n')):
+            values = df[column].to_numpy()[rows].tolist()
+            df_windows[column] = [separator.join(values[start:end]) for start, end in bounds]
+        df_windows['epoch'] = df['epoch'].to_numpy()[rows[starts]]
+        values = df['golden_signal'].to_numpy()[rows].tolist()
+        df_windows['golden_signal'] = [' '.join(values[start:end]) for start, end in bounds]
+        df_windows['len'] = np.diff(np.append(starts, len(rows)))
+
+        return df_windows
+
     def process_data(self, df_inference_csv, model_gs, model_fault, batch_size):
         """
         Processes the input DataFrame to detect golden signals and fault categories, and generates summary and anomaly reports.
@@ -315,17 +403,14 @@ class Core:
         # Backtracking GS and Fault Labels
         print("Backtracking GS and Fault Labels")
         start_time = time.time()
-        apply_func = self.backprop_gs_fault_with_temp_ids
-        try:
-            df_inference_csv[['golden_signal', 'text_output']] = df_inference_csv.parallel_apply(apply_func, axis=1, mapping=temp_id_to_signal_map)
-        except:
-            df_inference_csv[['golden_signal', 'text_output']] = df_inference_csv.progress_apply(apply_func, axis=1, mapping=temp_id_to_signal_map)
+        df_inference_csv['golden_signal'], df_inference_csv['text_output'] = self.backprop_gs_fault_with_temp_ids(df_inference_csv, temp_id_to_signal_map)
         print(f"Backtracking completed in: {time.time() - start_time} seconds")
 
         df_inference_csv['test_ids'] = df_inference_csv['test_ids'].astype(str)
-        df_inference_csv['error_test_ids'] = df_inference_csv.apply(lambda row: row['test_ids'] if row['golden_signal'] != 'Info' else 'info', axis=1)
+        is_info = df_inference_csv['golden_signal'].to_numpy() == 'Info'
+        df_inference_csv['error_test_ids'] = np.where(is_info, 'info', df_inference_csv['test_ids'].to_numpy())
 
-        df_inference_csv_only_non_info = df_inference_csv[df_inference_csv['golden_signal'] != "Info"].copy()
+        df_inference_csv_only_non_info = df_inference_csv[~is_info].copy()
         print("Data Frame Only Non-Information is as follows=>")
         print(df_inference_csv_only_non_info.head())
 
@@ -356,35 +441,17 @@ class Core:
         if not df_inference_csv_only_non_info.empty:
             df_inference_csv_only_non_info.drop(columns=['text'], inplace=True)
 
-        # Grouping by 'epoch' to create anomaly DataFrames
+        # Grouping by 'epoch' to create anomaly DataFrames. The rows are sorted by window once and both the
+        # complete and the non-information anomaly DataFrames are aggregated from that order
         df_inference_csv['group'] = df_inference_csv['epoch'] // 30
-        df_for_anomaly_html = df_inference_csv.groupby('group').agg({
-            'test_ids': ' '.join,
-            'error_test_ids': ' '.join,
-            'file_names': '\n'.join,
-            'text_output': '\n'.join,
-            'epoch': 'first',
-            'golden_signal': ' '.join
-        }).reset_index()
+        window_codes, windows = pd.factorize(df_inference_csv['group'], sort=True)
+        rows = np.argsort(window_codes, kind='stable')
 
-        df_inference_csv_only_non_info['group'] = df_inference_csv_only_non_info['epoch'] // 30
-        df_for_anomaly_html_non_info = df_inference_csv_only_non_info.groupby('group').agg({
-            'test_ids': ' '.join,
-            'error_test_ids': ' '.join,
-            'file_names': '\n'.join,
-            'text_output': '\n'.join,
-            'epoch': 'first',
-            'golden_signal': " ".join
-        }).reset_index()
+        df_for_anomaly_html = self.aggregate_windows(df_inference_csv, rows, window_codes, windows)
+        df_for_anomaly_html_non_info = self.aggregate_windows(df_inference_csv, rows[~is_info[rows]], window_codes, windows)
 
         # Adding additional columns for the anomaly DataFrames
-        df_for_anomaly_html['all_info'] = df_for_anomaly_html['golden_signal'].apply(lambda gs: all(item.strip() == "Info" for item in gs.split()))
-        df_for_anomaly_html['len'] = df_for_anomaly_html['test_ids'].apply(lambda seq: len(seq.split()))
-
-        if not df_for_anomaly_html_non_info.empty:
-            df_for_anomaly_html_non_info['len'] = df_for_anomaly_html_non_info['test_ids'].apply(lambda seq: len(seq.split()))
-        else:
-            df_for_anomaly_html_non_info['len'] = []
+        df_for_anomaly_html.insert(len(df_for_anomaly_html.columns) - 1, 'all_info', pd.Series(is_info, index=df_inference_csv.index).groupby(df_inference_csv['group']).all().to_numpy())
 
         print(f"Total Windows: {len(df_for_anomaly_html)}")
         
@@ -1,12 +1,17 @@
 from enum import Enum
 from typing import Union
+import numpy as np
+import torch
 from logan.log_diagnosis.models.manager import ModelTemplate
-from transformers import pipeline
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
 class ZeroShotModels(Enum):
     BART = 'facebook/bart-large-mnli'
     CROSSENCODER = 'cross-encoder/nli-MiniLM2-L6-H768'
 
+# Same hypothesis template as the transformers zero-shot-classification pipeline
+HYPOTHESIS_TEMPLATE = "This example is {}."
+
 class ModelZeroShotClassifer(ModelTemplate):
     def __init__(self, model: Union[ZeroShotModels, str]):
         """
@@ -24,20 +29,98 @@ class ModelZeroShotClassifer(ModelTemplate):
             self.model = model
 
     def init_model(self):
-        self.pipe = pipeline(task='zero-shot-classification', model=self.model)
+        # Run on the GPU in half precision when one is available, otherwise fall back to FP32 on the CPU
+        if torch.cuda.is_available():
+            self.device = torch.device('cuda', 0)
+            self.nli_model = AutoModelForSequenceClassification.from_pretrained(self.model, torch_dtype=torch.float16)
+        else:
+            self.device = torch.device('cpu')
+            self.nli_model = AutoModelForSequenceClassification.from_pretrained(self.model)
+        self.nli_model.to(self.device).eval()
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        # Index of the entailment logit, looked up as the zero-shot-classification pipeline does
+        self.entailment_id = next(
+            (idx for label, idx in self.nli_model.config.label2id.items() if label.lower().startswith("entail")), -1
+        )
+
+        # The candidate labels are constant, so their hypotheses are tokenized once per label set
+        self.hypothesis_ids = {}
+
+    def encode_pairs(self, premises: list[str], hypothesis_ids: list[list[int]]):
+        """
+        Builds the model inputs for every (premise, hypothesis) pair.
+
+        Each premise is tokenized once and combined with the cached hypothesis tokens. Only the premise is
+        truncated, so that the hypothesis is always complete.
+
+        Args:
+            premises: Log texts to classify.
+            hypothesis_ids: Token IDs of the hypothesis of each candidate label, without special tokens.
+
+        Returns:
+            BatchEncoding: Padded tensors for the len(premises) * len(hypothesis_ids) pairs, premise-major.
+        """
+        premise_ids = self.tokenizer(premises, add_special_tokens=False, verbose=False)['input_ids']
+        num_special_tokens = self.tokenizer.num_special_tokens_to_add(pair=True)
+
+        features = []
+        for ids in premise_ids:
+            for hyp_ids in hypothesis_ids:
+                max_premise_length = self.tokenizer.model_max_length - num_special_tokens - len(hyp_ids)
+                pair_premise_ids = ids[:max_premise_length] if len(ids) > max_premise_length > 0 else ids
+                features.append(self.tokenizer.prepare_for_model(pair_premise_ids, hyp_ids, add_special_tokens=True, truncation=False, verbose=False))
+
+        return self.tokenizer.pad(features, padding=True, return_tensors='pt', verbose=False)
+
+    def classify(self, input: list[str], candidate_labels: list[str], batch_size: int = 32):
+        """
+        Zero-shot classifies the input texts by the entailment of "This example is <label>." for each label.
+
+        Args:
+            input: List of log text strings to classify.
+            candidate_labels: The labels to choose from.
+            batch_size: Number of (text, label) pairs per forward pass.
+
+        Returns:
+            List of dictionaries with 'sequence', 'labels' and 'scores' keys, labels sorted by descending score.
+        """
+        labels_key = tuple(candidate_labels)
+        if labels_key not in self.hypothesis_ids:
+            self.hypothesis_ids[labels_key] = self.tokenizer(
+                [HYPOTHESIS_TEMPLATE.format(label) for label in candidate_labels], add_special_tokens=False
+            )['input_ids']
+        hypothesis_ids = self.hypothesis_ids[labels_key]
+
+        premises_per_batch = max(1, batch_size // len(candidate_labels))
+        results = []
+        for start in range(0, len(input), premises_per_batch):
+            premises = input[start:start + premises_per_batch]
+            inputs = self.encode_pairs(premises, hypothesis_ids).to(self.device)
+
+            with torch.inference_mode():
+                logits = self.nli_model(**inputs).logits
+
+            # Softmax the entailment logits over all candidate labels of each premise
+            entail_logits = logits[:, self.entailment_id].float().view(len(premises), len(candidate_labels))
+            scores = entail_logits.softmax(dim=-1).cpu().numpy()
+
+            for premise, premise_scores in zip(premises, scores):
+                top_inds = np.argsort(premise_scores)[::-1]
+                results.append({
+                    "sequence": premise,
+                    "labels": [candidate_labels[i] for i in top_inds],
+                    "scores": premise_scores[top_inds].tolist(),
+                })
+        return results
 
     def classify_golden_signal(self, input: list[str], batch_size: int=32):
         candidate_labels = ["information", "error", "availability", "latency", "saturation", "traffic"]
-        results = self.pipe(input, candidate_labels, batch_size=batch_size)
-        if isinstance(results, dict):
-            # zero shot classification returns a dictionary for a single input, so we need to convert it to a list
-            results = [results]
-        return results
-    
+        return self.classify(input, candidate_labels, batch_size)
+
     def classify_fault_category(self, input: list[str], batch_size: int=32):
         candidate_labels = ["io", "authentication", "network", "application", "device"]
-        results = self.pipe(input, candidate_labels, batch_size=batch_size)
-        if isinstance(results, dict):
-            # zero shot classification returns a dictionary for a single input, so we need to convert it to a list
-            results = [results]
-        return results
+        return self.classify(input, candidate_labels, batch_size)
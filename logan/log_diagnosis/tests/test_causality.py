@@ -0,0 +1,50 @@
+import sys
+import numpy as np
+import pytest
+
+stattools = pytest.importorskip("statsmodels.tsa.stattools")
+from statsmodels.tools.sm_exceptions import InfeasibleTestError
+
+# statsmodels is only a test reference; verbose=False keeps it from printing, at the cost of a deprecation warning
+pytestmark = pytest.mark.filterwarnings("ignore:verbose is deprecated:FutureWarning")
+
+@pytest.fixture(scope="module")
+def causality():
+    # causality parses the command line when it is imported
+    argv = sys.argv
+    sys.argv = ["causality.py"]
+    try:
+        import causality
+    finally:
+        sys.argv = argv
+    return causality
+
+def differenced_series(seed, n=500):
+    rng = np.random.default_rng(seed)
+    base = rng.poisson(3, n).astype(float)
+    target = np.roll(base, 2) + rng.poisson(2, n)
+    partners = np.stack([base + rng.poisson(1, n), rng.poisson(3, n), np.roll(base, 4) * 0.5 + rng.poisson(1, n)])
+    return np.diff(target), np.diff(partners, axis=1)
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_granger_tests_match_statsmodels(causality, seed):
+    maxlag = 5
+    target, partners = differenced_series(seed)
+    stats, pvalues = causality.granger_tests(target, partners, maxlag)
+
+    for row, partner in enumerate(partners):
+        results = stattools.grangercausalitytests(np.column_stack((target, partner)), maxlag, verbose=False)
+        for lag in range(1, maxlag + 1):
+            expected_stat, expected_pvalue, _ = results[lag][0]["ssr_chi2test"]
+            assert stats[row, lag - 1] == pytest.approx(expected_stat, rel=1e-9)
+            assert pvalues[row, lag - 1] == pytest.approx(expected_pvalue, rel=1e-9, abs=1e-12)
+
+def test_granger_tests_infeasible_partner(causality):
+    target, partners = differenced_series(0)
+    partners[1] = 0.0
+    stats, pvalues = causality.granger_tests(target, partners, 3)
+
+    with pytest.raises(InfeasibleTestError):
+        stattools.grangercausalitytests(np.column_stack((target, partners[1])), 3, verbose=False)
+    assert np.isnan(stats[1]).all() and np.isnan(pvalues[1]).all()
+    assert not np.isnan(pvalues[[0, 2]]).any()
@@ -5,48 +5,140 @@ import re
 import os
 from argparse import ArgumentParser
 import shutil
-import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+import numpy as np
 import pandas as pd
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from logan.telemetry.es import get_elasticsearch_config, get_feedback_index
 
+# Patterns used to sanitize log text for the HTML reports, compiled once at import time
+SCRIPT_TAG_PATTERN = re.compile(r'</?script>', re.IGNORECASE)
+TAG_PATTERN = re.compile(r'<[^>]*>')
+
+# Jinja environment shared by the HTML reports. Templates are parsed on first use and then served from the
+# environment's cache without checking the template files for changes again. The compiled templates are also
+# kept in a per-user bytecode cache in the temporary directory, so later runs skip compiling them.
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+JINJA_ENV = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR), auto_reload=False, cache_size=50, bytecode_cache=FileSystemBytecodeCache()
+)
+
 def get_b64_encoded_credentials(username, passwd):
     credentials = f'{username}:{passwd}'
     return base64.b64encode(credentials.encode()).decode('ascii')
 
-def row_size(row):
+def estimate_row_sizes(df):
     """
-    Calculates the memory size of a given row.
-    
+    Estimates the memory size of every row of a DataFrame without building a Series per row.
+
+    The size of a row is the length of its string values plus the average number of bytes
+    the DataFrame holds per row for the values themselves.
+
     Args:
-        row (pd.Series): A row of the DataFrame.
-    
+        df (pd.DataFrame): The input DataFrame.
+
     Returns:
-        int: Size of the row in bytes.
+        np.ndarray: Estimated size of each row in bytes.
     """
-    return sys.getsizeof(row)
+    if len(df) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    sizes = np.full(len(df), df.memory_usage(deep=False, index=False).sum() / len(df))
+    for column in df.columns[df.dtypes == object]:
+        sizes += df[column].str.len().fillna(0).to_numpy(dtype=np.float64)
+    return sizes.astype(np.int64)
+
+def _br_run_end(text, start):
+    """
+    Finds the end of a run of consecutive <br> tags (<br>, <br/>, <br />, ...) and the whitespace after them.
+
+    Args:
+        text (str): The input string.
+        start (int): Position of the '<' the run should start at.
+
+    Returns:
+        int: The position right after the run, or -1 if no <br> tag starts at `start`.
+    """
+    end = -1
+    n = len(text)
+    while text.startswith('<br', start):
+        pos = start + 3
+        while pos < n and text[pos].isspace():
+            pos += 1
+        if pos < n and text[pos] == '/':
+            pos += 1
+        if pos >= n or text[pos] != '>':
+            break
+        pos += 1
+        while pos < n and text[pos].isspace():
+            pos += 1
+        end = start = pos
+    return end
 
 def replace_tags(text):
     """
     Replace specific HTML tags with &lt; and &gt; and escape HTML entities in the given text.
+
+    Script tags are removed, runs of consecutive <br> tags are collapsed to a single <br>, <br>, <br/> and
+    </br> tags are kept and everything else is escaped. The text is scanned once from tag to tag.
     Args:
         text (str): The input string containing HTML tags and entities.
     Returns:
         str: The cleaned string with specific HTML tags replaced and entities escaped.
     """
     try:
+        # Most log lines contain no tags at all
+        if '<' not in text:
+            return html.escape(text, quote=False)
+
         # Replace specific tags
-        text = re.sub(r'</?script>', '', text, flags=re.IGNORECASE)
-        # Replace multiple consecutive <br> tags with a single <br>
-        text = re.sub(r'(<br\s*/?>\s*)+', '<br>', text)
-        
-        # Replace all other HTML tags with &lt; and &gt;, except <br> and <br/> tags
-        parts = re.split(r'(<[^>]+>)', text)
-        for i in range(len(parts)):
-            if parts[i].lower() not in ('<br>', '<br/>', '</br>'):
-                parts[i] = html.escape(parts[i],quote=False)
+        text = SCRIPT_TAG_PATTERN.sub('', text)
+
+        parts = []
+        literal_start = 0
+        tag_start = text.find('<')
+        while tag_start != -1:
+            # Replace multiple consecutive <br> tags with a single <br>
+            br_end = _br_run_end(text, tag_start)
+            if br_end != -1:
+                parts.append(html.escape(text[literal_start:tag_start], quote=False))
+                parts.append('<br>')
+                literal_start = br_end
+                tag_start = text.find('<', br_end)
+                continue
+
+            tag_end = text.find('>', tag_start + 1)
+            if tag_end == -1:
+                break
+            if tag_end == tag_start + 1:
+                # '<>' is not a tag
+                tag_start = text.find('<', tag_end)
+                continue
+
+            parts.append(html.escape(text[literal_start:tag_start], quote=False))
+
+            # A <br> run starting at the last '<' of the tag is collapsed first and becomes part of the tag
+            inner_start = text.rfind('<', tag_start + 1, tag_end)
+            br_end = _br_run_end(text, inner_start) if inner_start != -1 else -1
+            if br_end != -1:
+                parts.append(html.escape(text[tag_start:inner_start], quote=False) + '&lt;br&gt;')
+                literal_start = br_end
+            else:
+                # Replace all other HTML tags with &lt; and &gt;, except <br>, <br/> and </br> tags
+                tag = text[tag_start:tag_end + 1]
+                parts.append(tag if tag.lower() in ('<br>', '<br/>', '</br>') else html.escape(tag, quote=False))
+                literal_start = tag_end + 1
+            tag_start = text.find('<', literal_start)
+
+        parts.append(html.escape(text[literal_start:], quote=False))
         text = ''.join(parts)
     except TypeError:
         print(f"Error in replacing HTML tags for text: {text}")
@@ -56,39 +148,27 @@ def replace_tags(text):
 def split_df_on_size(df, threshold):
     """
     Splits a DataFrame into chunks such that each chunk's total memory size is below the specified threshold.
+
+    Chunks are yielded one at a time, so the caller can release each chunk before the next one is built.
     
     Args:
         df (pd.DataFrame): The input DataFrame to be split.
         threshold (int): The maximum size (in bytes) for each chunk.
     
-    Returns:
-        list: A list of DataFrames, each representing a chunk within the size limit.
+    Yields:
+        pd.DataFrame: A slice of the DataFrame within the size limit.
     """
-    df['row_size_bytes'] = df.apply(row_size, axis=1)  # Calculate the size of each row in bytes.
-
-    current_size = 0  # Tracks the size of the current chunk.
-    chunks = []  # Holds all the chunks created from splitting.
-    chunk = []  # Holds the current chunk of rows.
-
-    # Iterate through each row in the DataFrame.
-    for index, row in df.iterrows():
-        row_bytes = row["row_size_bytes"]
-        # If adding the current row doesn't exceed the threshold, add it to the chunk.
-        if current_size + row_bytes <= threshold:
-            chunk.append(row)
-            current_size += row_bytes
-        else:
-            # If the current chunk exceeds the threshold, store it and start a new chunk.
-            if len(chunk) > 0: 
-                chunks.append(pd.DataFrame(chunk))
-            chunk = [row]  # Start a new chunk with the current row.
-            current_size = row_bytes
-
-    # Add the last chunk if it exists.
-    if len(chunk) > 0:  
-        chunks.append(pd.DataFrame(chunk))
-
-    return chunks
+    sizes = estimate_row_sizes(df)
+    cumulative_sizes = np.cumsum(sizes)  # Total size of the rows up to and including each row.
+
+    start = 0  # Position of the first row of the current chunk.
+
+    # Grow each chunk while its rows fit within the threshold; a row larger than the threshold gets a chunk of its own.
+    while start < len(df):
+        size_before = cumulative_sizes[start - 1] if start > 0 else 0
+        end = max(start + 1, int(np.searchsorted(cumulative_sizes, size_before + threshold, side='right')))
+        yield df.iloc[start:end]
+        start = end
 
 def create_feedback_variable():
     """
@@ -103,16 +183,73 @@ def create_feedback_variable():
     es_config['token'] = get_b64_encoded_credentials(es_config['username'], es_config['password'])  
     return es_config
 
-def get_anomaly_html_str(df_final_anomalies, output_dir):
+def _write_chunk(idx, df_anomaly, output_prefix, report_format='json'):
+    """
+    Converts a chunk of anomaly windows into JSON objects and saves them as the idx-th data file.
+
+    Args:
+        idx (int): Zero-based index of the chunk.
+        df_anomaly (pd.DataFrame): The anomaly windows of the chunk.
+        output_prefix (str): Prefix of the output data files.
+        report_format (str): 'json' for the files read by the HTML report, or 'parquet' to save the
+            windows as zstd compressed Parquet files instead. Defaults to 'json'.
+
+    Returns:
+        int: Number of windows in the chunk.
+    """
+    if report_format == 'parquet':
+        output_file = f"{output_prefix}_{idx+1}.parquet"
+        df_anomaly.to_parquet(output_file, compression='zstd', index=False)
+        print(f"Written chunk {idx+1} to {output_file}")
+        return len(df_anomaly)
+
+    # Convert each row of the DataFrame into a JSON object, working on whole columns instead of boxed rows.
+    output_json_obj = []  # Prepare a list to store JSON objects.
+    for start, end, each_window, file_window, templates in zip(
+        df_anomaly["start_ts"].tolist(), df_anomaly["end_ts"].tolist(), df_anomaly["list_logs"].tolist(),
+        df_anomaly["list_files"].tolist(), df_anomaly["list_templates"].tolist()
+    ):
+        logs = each_window.split('\n')  # Split logs by newline.
+        output_json_obj.append({
+            'duration': f"{start} -- \n {end}",
+            'logs': logs,
+            'files': file_window.split('\n'),  # Split file names by newline.
+            # The last element in each log represents the golden signal (gs).
+            'gs': [item.rsplit('=>', 1)[-1].split()[-1].strip() for item in logs],
+            'templateIds': templates.split(" "),
+        })
+
+    # Save the JSON object to a file.
+    output_file = f"{output_prefix}_{idx+1}.json"
+
+    # The chunks are only read back by the report page, so they are written without indentation.
+    if orjson is not None:
+        output_json_bytes = orjson.dumps(output_json_obj)
+    else:
+        output_json_bytes = json.dumps(output_json_obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    # Write the encoded chunk in a single call through a binary file.
+    with open(output_file, 'wb', buffering=1 << 20) as output_json_file:
+        output_json_file.write(output_json_bytes)
+
+    print(f"Written chunk {idx+1} to {output_file}")
+    return len(df_anomaly)
+
+def get_anomaly_html_str(df_final_anomalies, output_dir, num_workers=1, report_format='json'):
     """
     Generates an HTML string for anomaly data and saves the JSON representation of the data in chunks.
     
     Args:
         df_final_anomalies (pd.DataFrame): DataFrame containing anomaly information.
         output_dir (str): Directory path where output files should be saved.
+        num_workers (int): Number of processes used to write the chunks. None uses one per CPU. Defaults to 1,
+            which writes the chunks one after another in the current process.
+        report_format (str): Format of the data chunks, 'json' or 'parquet'. The HTML report only loads JSON
+            chunks; Parquet chunks are smaller and faster to write for use in other tools, and no HTML is
+            rendered for them. Defaults to 'json'.
     
     Returns:
-        str: Rendered HTML string for the anomalies.
+        str: Rendered HTML string for the anomalies, or None when the chunks are written as Parquet.
     """
     
     # If no anomalies are present, notify the user.
@@ -120,57 +257,36 @@ def get_anomaly_html_str(df_final_anomalies, output_dir):
         print("No anomalies detected") 
     
     # Remove HTML tags from log entries.
-    tag_pattern = re.compile(r'<[^>]*>')
-    df_final_anomalies['list_logs'] = df_final_anomalies['list_logs'].apply(lambda log: re.sub(tag_pattern, '', log))
+    df_final_anomalies['list_logs'] = df_final_anomalies['list_logs'].str.replace(TAG_PATTERN, '', regex=True)
     
     # Split the DataFrame into smaller chunks, each under 2.5 MB.
-    list_chunked_df = split_df_on_size(df_final_anomalies, threshold=2.5*1024*1024)  # 2.5 MB splits
+    chunked_df = split_df_on_size(df_final_anomalies, threshold=2.5*1024*1024)  # 2.5 MB splits
     
-    chunk_size = []  # To track the size of each chunk.
-    output_prefix = f'{output_dir}/developer_debug_files/data'  # Prefix for the output JSON files.
+    output_prefix = os.path.join(output_dir, 'developer_debug_files', 'data')  # Prefix for the output data files.
     
-    # Iterate through each chunk and save it as a JSON file.
-    for idx, df_anomaly in enumerate(list_chunked_df):
-        chunk_size.append(len(df_anomaly))  # Record the size of the current chunk.
-        output_json_obj = []  # Prepare a list to store JSON objects.
-        
-        # Convert each row of the DataFrame into a JSON object.
-        for _, row in df_anomaly.iterrows():
-            temp_json_obj = {}
-            start, end, each_window, file_window, templates = row["start_ts"], row["end_ts"], row["list_logs"], row["list_files"], row["list_templates"]
-
-            duration = f"{start} -- \n {end}"
-            logs = each_window.split('\n')  # Split logs by newline.
-            files = file_window.split('\n')  # Split file names by newline.
-
-            # Extract the last element in logs that represents the golden signal (gs).
-            list_of_gs = [item.split('=>')[-1].split()[-1].strip() for item in logs]
-            list_of_templates = templates.split(" ")
-
-            temp_json_obj['duration'] = duration
-            temp_json_obj['logs'] = logs
-            temp_json_obj['files'] = files
-            temp_json_obj['gs'] = [gs.strip() for gs in list_of_gs]
-            temp_json_obj['templateIds'] = list_of_templates
-            output_json_obj.append(temp_json_obj)
-        
-        # Save the JSON object to a file.
-        output_file = f"{output_prefix}_{idx+1}.json"
-        
-        with open(output_file, 'w') as output_json_file:
-            json.dump(output_json_obj, output_json_file, indent=4)
-            
-        print(f"Written chunk {idx+1} to {output_file}")
+    # Save each chunk as a data file. With several workers the chunks are encoded in parallel, which only
+    # pays off when there is more than one chunk.
+    if num_workers != 1:
+        chunked_df = list(chunked_df)
+    if num_workers == 1 or len(chunked_df) < 2:
+        chunk_size = [_write_chunk(idx, df_anomaly, output_prefix, report_format) for idx, df_anomaly in enumerate(chunked_df)]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            chunk_size = list(executor.map(
+                _write_chunk, range(len(chunked_df)), chunked_df, repeat(output_prefix), repeat(report_format)
+            ))
     
-    # Create a Jinja environment to render the HTML template.
-    path = os.path.dirname(os.path.abspath(__file__))
-    env = Environment(loader=FileSystemLoader(os.path.join(path, 'templates')))
-    html_template = env.get_template('anomalies.html')
+    # The HTML report can only load JSON chunks
+    if report_format == 'parquet':
+        return None
+
+    # Load the HTML template from the shared Jinja environment.
+    html_template = JINJA_ENV.get_template('anomalies.html')
 
     # Render the HTML template using the provided data.
     rendered_template = html_template.render(
         chunk_size=chunk_size, 
-        no_of_chunks=len(list_chunked_df), 
+        no_of_chunks=len(chunk_size), 
         no_of_windows=sum(chunk_size), 
         zip=zip, set=set, 
         output_dir='../developer_debug_files', 
@@ -224,19 +340,21 @@ def get_summary_html_str(df_for_summary_html, include_golden_signal_dropdown, ig
     Returns:
         str: Rendered HTML string for the summary report.
     """
-    # Round coverage values to four decimal places.
-    df_for_summary_html = df_for_summary_html[['d_tid', 'text', 'gs', 'd_tid_count', 'coverage', 'file_names']]
-    df_for_summary_html['coverage'] = df_for_summary_html['coverage'].apply(lambda val: round(val, 4))
-
-    df_for_summary_html['text'] = df_for_summary_html['text'].apply(replace_tags)
+    # Select the report columns once, round coverage values to four decimal places and sanitize the template texts.
+    # replace_tags already returns tagless texts after a single escape, so a plain pass over the values is cheaper
+    # than masking the column first.
+    df_for_summary_html = df_for_summary_html[['d_tid', 'text', 'gs', 'd_tid_count', 'coverage', 'file_names']].copy()
+    df_for_summary_html['coverage'] = np.round(df_for_summary_html['coverage'].to_numpy(dtype=np.float64), 4)
+    df_for_summary_html['text'] = [replace_tags(text) for text in df_for_summary_html['text'].tolist()]
+    # Many templates come from the same files, so the distinct file names are collected from the categories,
+    # which astype('category') already keeps in sorted order.
+    df_for_summary_html['file_names'] = df_for_summary_html['file_names'].astype('category')
 
     num_log_lines_total, file_size_bytes, file_size_display = _load_preprocessing_metrics(output_dir)
     num_log_lines_display = f'{num_log_lines_total:,}' if num_log_lines_total is not None else None
 
-    # Create a Jinja environment to render the summary HTML template.
-    path = os.path.dirname(os.path.abspath(__file__))
-    env = Environment(loader=FileSystemLoader(os.path.join(path, 'templates')))
-    html_template = env.get_template('summary_golden_signal_error.html')
+    # Load the summary HTML template from the shared Jinja environment.
+    html_template = JINJA_ENV.get_template('summary_golden_signal_error.html')
 
     # Render the summary HTML template.
     rendered_template = html_template.render(
@@ -244,7 +362,7 @@ def get_summary_html_str(df_for_summary_html, include_golden_signal_dropdown, ig
         include_golden_signal_dropdown=include_golden_signal_dropdown,
         ignored_file_list=ignored_file_list,
         processed_file_list=processed_file_list,
-        unique_file_names=sorted(df_for_summary_html['file_names'].unique().tolist()),
+        unique_file_names=df_for_summary_html['file_names'].cat.categories.tolist(),
         num_log_lines_total=num_log_lines_total,
         num_log_lines_display=num_log_lines_display,
         file_size_bytes=file_size_bytes,
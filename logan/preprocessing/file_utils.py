@@ -2,7 +2,10 @@
 File utilities for preprocessing
 '''
 
-def count_file_lines(filepath, chunk_size=1024*1024):
+# Bytes removed by bytes.strip(), except the newline that separates the lines
+WHITESPACE_BYTES = b" \t\r\x0b\x0c"
+
+def count_file_lines(filepath, chunk_size=4*1024*1024):
     '''
     Counts the number of lines in a file
 
@@ -14,13 +17,13 @@ def count_file_lines(filepath, chunk_size=1024*1024):
         int: The number of lines in the file
     '''
     count = 0
-    with open(filepath, "rb") as f:
-        leftover = b""
+    with open(filepath, "rb", buffering=0) as f:
+        last_byte = b""
         while chunk := f.read(chunk_size):
             count += chunk.count(b"\n")
-            leftover = chunk
+            last_byte = chunk[-1:]
         # if last chunk doesn’t end with newline, add 1
-        if leftover and not leftover.endswith(b"\n"):
+        if last_byte and last_byte != b"\n":
             count += 1
     return count
 
@@ -36,15 +39,64 @@ def count_file_line_whitespaces(filepath, chunk_size=1024*1024):
         int: The number of empty lines in the file
     '''
     count = 0
-    buffer = b""
+    # whether the line carried over from the previous chunk only holds whitespaces so far
+    partial_is_blank = True
     with open(filepath, "rb") as f:
         while chunk := f.read(chunk_size):
-            buffer += chunk
-            *lines, buffer = buffer.split(b"\n")
-            for line in lines:
-                if not line.strip():
-                    count += 1
+            chunk_count, partial_is_blank = count_chunk_whitespace_lines(chunk, partial_is_blank)
+            count += chunk_count
     # check last line
-    if not buffer.strip():
+    if partial_is_blank:
         count += 1
     return count
+
+def count_chunk_whitespace_lines(chunk, partial_is_blank):
+    '''
+    Counts the lines with only whitespaces completed in a chunk of a file, without keeping the incomplete
+    last line: only whether it is blank so far is carried over to the next chunk
+
+    Args:
+        chunk (bytes): The chunk of the file
+        partial_is_blank (bool): Whether the line carried over from the previous chunk only holds whitespaces
+
+    Returns:
+        tuple: The number of empty lines completed in the chunk, and whether the line carried over to the next chunk only holds whitespaces
+    '''
+    # whitespace only lines become empty pieces once the whitespaces are removed
+    pieces = chunk.translate(None, WHITESPACE_BYTES).split(b"\n")
+    first_blank, last_blank = not pieces[0], not pieces[-1]
+    if len(pieces) == 1:
+        return 0, partial_is_blank and first_blank
+    # the first piece completes the carried over line, the last one is carried over to the next chunk
+    count = (partial_is_blank and first_blank) + pieces.count(b"") - first_blank - last_blank
+    return count, last_blank
+
+def count_file_lines_and_whitespaces(filepath, chunk_size=1024*1024):
+    '''
+    Counts the number of lines and the number of lines with only whitespaces in a file,
+    reading the file once. The counts are the same as count_file_lines and count_file_line_whitespaces.
+
+    Args:
+        filepath (str): The path to the file to count the lines of
+        chunk_size (int): The size of the chunk to read in at a time
+
+    Returns:
+        tuple: The number of lines and the number of empty lines in the file
+    '''
+    count = 0
+    whitespace_count = 0
+    last_byte = b""
+    partial_is_blank = True
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunk_size):
+            count += chunk.count(b"\n")
+            last_byte = chunk[-1:]
+            chunk_count, partial_is_blank = count_chunk_whitespace_lines(chunk, partial_is_blank)
+            whitespace_count += chunk_count
+    # if last chunk doesn’t end with newline, add 1
+    if last_byte and last_byte != b"\n":
+        count += 1
+    # check last line
+    if partial_is_blank:
+        whitespace_count += 1
+    return count, whitespace_count
@@ -1,38 +1,31 @@
 import os
 import pandas as pd
-from tqdm import tqdm
-from pandarallel import pandarallel
 import argparse
 from dateutil import parser as god_parse
-import json
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-pandarallel.initialize(progress_bar=False)
-tqdm.pandas()
+from logan.json_utils import load_json
 
 def get_start_end(start_str, duration):
     parsed_date = god_parse.parse(start_str)
     epoch = parsed_date.timestamp()
     return epoch, epoch+duration
     
+def load_json_file(file):
+    return load_json(file.read_bytes())
+
 def get_df(path, id_name):
-    files = list(Path(path).glob('*.json'))
-    dataframes = []
-    
-    for file in files:
-        with file.open(mode='r') as reader:
-            d = json.load(reader) 
-        logs = d.keys()
-        ids = d.values()
-        
-        df = pd.DataFrame.from_dict({"truncated_text": logs, f"{id_name}": ids})
-        dataframes.append(df)
-    
-    if len(dataframes) == 0:
-        dataframes = [pd.DataFrame(columns=['truncated_text', id_name])]
-    
-    return pd.concat(dataframes, ignore_index=True).drop_duplicates()
+    # The files are read by a thread pool, so that their reads overlap with the parsing of the others.
+    # map yields them in the glob order, the (log, id) pairs of all files are deduplicated while loading,
+    # keeping the first occurrence of each pair
+    pairs = {}
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        for d in executor.map(load_json_file, Path(path).glob('*.json')):
+            pairs.update(dict.fromkeys(d.items()))
+
+    return pd.DataFrame(list(pairs), columns=['truncated_text', id_name])
 
 if __name__ == "__main__":
 
@@ -73,16 +66,15 @@ if __name__ == "__main__":
         df_train_ids = get_df(args.input_file_train, "train_ids")
         df_merged = pd.merge(df_merged, df_train_ids, on='truncated_text', how='inner')
         
-    df_merged["format"] = ["%Y-%m-%d %H:%M:%S"]*len(df_merged)
+    df_merged["format"] = "%Y-%m-%d %H:%M:%S"
     
     print(df_merged)
 
     df_merged = df_merged.dropna()
     df_merged = df_merged.sort_values(by='epoch')
 
-    if args.start_time == "none":
-        df_merged.to_csv(f"{args.output_dir}/{args.output_file_name}.csv", index=False, quoting=csv.QUOTE_NONE, quotechar='',escapechar='\\')
-    else:
+    output_file = os.path.join(args.output_dir, f"{args.output_file_name}.csv")
+    if args.start_time != "none":
         start, end = get_start_end(args.start_time, int(args.duration))
         df_merged = df_merged[(df_merged['epoch'] >= start) & (df_merged['epoch'] <= end)]
-        df_merged.to_csv(f"{args.output_dir}/{args.output_file_name}.csv", index=False, quoting=csv.QUOTE_NONE, quotechar='',escapechar='\\')
+    df_merged.to_csv(output_file, index=False, quoting=csv.QUOTE_NONE, quotechar='',escapechar='\\')
@@ -10,26 +10,38 @@ import pandas as pd
 import csv
 
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 import patoolib
-from pandarallel import pandarallel
 import time
 import numpy as np
 from dateutil import parser as god_parse
 
+from logan.json_utils import load_json
 from logan.preprocessing import file_utils, pyrbras
 
 # Global variables
 rbr = None
 is_initialized = False
+worker_preprocessing = None
+tzinfos_by_id = {}  # Timezone dictionaries passed to parse_timestamp, kept alive so that their ids stay unique
 
 # Constants
 DEFAULT_CONFIG = "config.ini"
 DEFAULT_CONFIG_SECTION = "preprocessing"
-
-# Initialize pandarallel
-pandarallel.initialize(progress_bar=True)
+RBR_MODEL_MANIFEST = os.path.join(os.path.dirname(__file__), 'model', 'manifest.json')
+ASCII_LETTERS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+ASCII_DIGITS = b"0123456789"
+# Maximum number of log lines whose extracted timestamp is cached
+EXTRACT_TS_CACHE_SIZE = 65536
+# Master formats whose zero padded matches are parsed with strptime instead of dateutil
+ISO_TIMESTAMP_FORMATS = frozenset([
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M:%S,%f'
+])
+# Extensions that patoolib always recognizes as archives, files ending with them skip its probe
+ARCHIVE_EXTENSIONS = frozenset(['.zip', '.tar', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst'])
 
 def initialize_once():
     """
@@ -38,30 +50,105 @@ def initialize_once():
     """
     global rbr, timezone_dict, is_initialized
     if not is_initialized:
-        rbr = pyrbras.load_model(os.path.join(os.path.dirname(__file__), 'model', 'manifest.json'))
+        rbr = pyrbras.load_model(RBR_MODEL_MANIFEST)
         is_initialized = True
 
+def initialize_worker(preprocessing):
+    """
+    Initializes a worker of the preprocessing pool: loads the rbr model once and keeps the Preprocessing
+    instance whose methods are applied to the logs.
+    """
+    global worker_preprocessing
+    initialize_once()
+    worker_preprocessing = preprocessing
+
+def process_log_in_worker(log):
+    return worker_preprocessing.process_fn(
+        log, worker_preprocessing.timezone_dict, worker_preprocessing.master_timestamp_list, worker_preprocessing.master_format_list
+    )
+
+def process_json_in_worker(json_obj):
+    return worker_preprocessing.process_fn_json(json_obj)
+
+def process_value_in_worker(value):
+    # detect_jsons has already decoded the json objects, the multiline logs are still strings
+    if isinstance(value, dict):
+        return process_json_in_worker(value)
+    return process_log_in_worker(value)
+
+@lru_cache(maxsize=200_000)
+def parse_timestamp_cached(time_stamp_str, tzinfos_id, today_ordinal):
+    """
+    Parses a timestamp string with dateutil and caches the outcome, including parse errors.
+
+    today_ordinal is only part of the cache key: dateutil fills in missing date parts from the current day.
+    """
+    try:
+        return god_parse.parse(time_stamp_str, tzinfos=tzinfos_by_id[tzinfos_id]), None
+    except Exception as e:
+        return None, e
+
+def parse_timestamp(time_stamp_str, tzinfos=None):
+    """
+    Drop-in replacement for dateutil's parser.parse(time_stamp_str, tzinfos=tzinfos) that caches the results.
+
+    Timestamp strings repeat heavily across log lines, so most calls are answered from the cache.
+
+    Args:
+        time_stamp_str (str): The timestamp string to parse.
+        tzinfos (dict): Timezone names mapped to timezones, as accepted by dateutil.
+
+    Returns:
+        datetime: The parsed datetime.
+    """
+    tzinfos_id = id(tzinfos)
+    if tzinfos_id not in tzinfos_by_id:
+        tzinfos_by_id[tzinfos_id] = tzinfos
+    parsed_date, error = parse_timestamp_cached(time_stamp_str, tzinfos_id, date.today().toordinal())
+    if error is not None:
+        raise error.with_traceback(None)
+    return parsed_date
+
 class Preprocessing:
-    def __init__(self, debug_mode):
+    def __init__(self, debug_mode, num_workers=None):
         self.df = None
 
         self.debug_mode = debug_mode
+        # Number of processes used to process the log lines, defaults to the number of CPUs
+        self.num_workers = max(1, int(num_workers or os.cpu_count() or 1))
         self.pattern_txt = re.compile(r'^.+\.txt(\.-)?\d*$')
         self.pattern_log = re.compile(r'^.+\.log(\.-)?\d*$')
 
         self.ip_pattern = re.compile(r'\b(?:\d{1,3}\.){3}\d{1,3}\b')
         self.url_pattern = re.compile(r'https?://\S+|www\.\S+')
         self.non_alphanumeric_pattern = re.compile(r'[^a-zA-Z0-9]')
-        self.digit_pattern = re.compile(r'\d+')
         self.split_pattern = re.compile(r'(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])')
-        self.whitespace_pattern = re.compile(r'\s+')
+        # Maps every ASCII character that is not a letter to a space, except digits which are dropped
+        self.ascii_letters_table = {
+            code: (None if chr(code).isdigit() else ' ') for code in range(128) if not chr(code).isalpha()
+        }
         self.continuos_spaces = re.compile(r'[^\S\n]+')
+        self.iso_timestamp_pattern = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[.,]\d{1,6})?')
         self.z_threshold = 2
         self.master_timestamp_list, self.master_format_list = self.get_master_lists()
+        # Lines without digits can only match the master patterns that do not use \d, e.g. the hexadecimal one
+        self.digit_pattern = re.compile(r'\d')
+        self.digitless_timestamp_list, self.digitless_format_list = [], []
+        for pattern, format in zip(self.master_timestamp_list, self.master_format_list):
+            if '\\d' not in pattern.pattern:
+                self.digitless_timestamp_list.append(pattern)
+                self.digitless_format_list.append(format)
+        self.extract_ts_cache, self.extract_ts_cache_day = {}, None
 
         # Load timezones from file
         timezones_file = os.path.join(os.path.dirname(__file__), 'timezones.json')
-        self.timezone_dict = json.load(open(timezones_file, 'r'))
+        with open(timezones_file, 'r') as f:
+            self.timezone_dict = load_json(f.read())
+        # Position and lengths of the timezone abbreviations, to look them up in the letter runs of a timestamp
+        self.timezone_index = {zone: index for index, zone in enumerate(self.timezone_dict)}
+        self.timezone_lengths = sorted(set(len(zone) for zone in self.timezone_dict))
+        self.letters_pattern = re.compile(r'[A-Za-z]+')
+        self.trailing_letters_pattern = re.compile(r'[A-Za-z]+$')
 
         config = configparser.ConfigParser()
         config_file = os.path.join(os.path.dirname(__file__), DEFAULT_CONFIG)
@@ -70,6 +157,10 @@ class Preprocessing:
         self.is_json_present = config[DEFAULT_CONFIG_SECTION]['is_json_present'] 
         self.json_message_field = ast.literal_eval(config.get(DEFAULT_CONFIG_SECTION, 'json_message_field')) if self.is_json_present == "true" else []
         self.json_time_field = ast.literal_eval(config.get(DEFAULT_CONFIG_SECTION, 'json_time_field')) if self.is_json_present == "true" else []
+        # The configured json fields do not change between records, so their lookups are prepared once
+        self.json_time_field_set = frozenset(self.json_time_field)
+        self.json_message_field_set = frozenset(self.json_message_field)
+        self.json_flatten_flag = any('_' in field for field in self.json_time_field) or any('_' in field for field in self.json_message_field)
         
         self.is_csv_present = config[DEFAULT_CONFIG_SECTION]['is_csv_present']
         self.csv_message_field = ast.literal_eval(config.get(DEFAULT_CONFIG_SECTION, 'csv_message_field')) if self.is_csv_present == "true" else []
@@ -112,6 +203,16 @@ class Preprocessing:
         # Reorder master_format_list according to the sorted indices
         master_format_list = [master_format_list[i] for i in sorted_indices]
 
+        # Drop the repeated pattern and format pairs, a repeat can only fail the same way as its first occurrence
+        seen_pairs = set()
+        unique_indices = []
+        for i, (pattern, format) in enumerate(zip(master_timestamp_list, master_format_list)):
+            if (pattern.pattern, format) not in seen_pairs:
+                seen_pairs.add((pattern.pattern, format))
+                unique_indices.append(i)
+        master_timestamp_list = [master_timestamp_list[i] for i in unique_indices]
+        master_format_list = [master_format_list[i] for i in unique_indices]
+
         return master_timestamp_list, master_format_list
 
     def count_alphabets_and_digits(self, logline):
@@ -124,20 +225,37 @@ class Preprocessing:
             alphabet-count (int)
             digit-count (int)
         """
+        if logline.isascii():
+            # Count by deleting the letters and the digits from the encoded line, which runs in C
+            encoded = logline.encode('ascii')
+            alphabet_count = len(encoded) - len(encoded.translate(None, ASCII_LETTERS))
+            digit_count = len(encoded) - len(encoded.translate(None, ASCII_DIGITS))
+            return alphabet_count, digit_count
+
         alphabet_count = sum(c.isalpha() for c in logline)
         digit_count = sum(c.isdigit() for c in logline)
         return alphabet_count, digit_count
 
     def preprocess_logs(self, logs):
         
-        # Preprocessing steps of logline for gs and fc predictions
-        logs = self.ip_pattern.sub("IPADDRESS", logs)
-        logs = self.url_pattern.sub("URL", logs)
-        logs = self.non_alphanumeric_pattern.sub(' ', logs)
-        logs = self.digit_pattern.sub('', logs)
-        logs = self.split_pattern.sub(' ', logs)
-        logs = self.whitespace_pattern.sub(' ', logs)
-        logs = logs.lower().strip()
+        # Preprocessing steps of logline for gs and fc predictions.
+        # The IP and URL patterns only run when the line can contain a match.
+        if logs.count('.') >= 3:
+            logs = self.ip_pattern.sub("IPADDRESS", logs)
+        if 'http' in logs or 'www.' in logs:
+            logs = self.url_pattern.sub("URL", logs)
+
+        # Replace non alphanumeric characters with spaces and drop digits in a single pass
+        logs = logs.translate(self.ascii_letters_table)
+        if not logs.isascii():
+            logs = self.non_alphanumeric_pattern.sub(' ', logs)
+
+        # Split camel case words, only lines with upper case letters can contain them
+        if not logs.islower():
+            logs = self.split_pattern.sub(' ', logs)
+
+        # Collapse whitespace runs and strip the line
+        logs = ' '.join(logs.split()).lower()
         return logs
 
     def compute_preprocessing_statistics(self, all_files, num_log_lines_processed, time, output_dir):
@@ -159,8 +277,9 @@ class Preprocessing:
         # Calculate file statistics
         for fp in all_files:
             total_size_bytes += os.path.getsize(fp)
-            num_log_lines_total += file_utils.count_file_lines(fp)
-            num_log_lines_whitespaces += file_utils.count_file_line_whitespaces(fp)
+            num_lines, num_whitespace_lines = file_utils.count_file_lines_and_whitespaces(fp)
+            num_log_lines_total += num_lines
+            num_log_lines_whitespaces += num_whitespace_lines
 
         metrics = {
             'file_size_bytes': total_size_bytes,
@@ -173,6 +292,58 @@ class Preprocessing:
         with open(os.path.join(output_dir, "metrics", "preprocessing.json"), 'w') as writer:
             writer.write(json.dumps(metrics, indent=4))
 
+    def group_multiline_logs(self, df):
+        """
+        Groups the lines of multiline logs: a line with a timestamp starts a new log, and the following lines
+        without a timestamp are appended to it. Files without any timestamp are returned separately.
+
+        Args:
+            df (dataframe): processed lines with their file names, in the order of the files
+        Returns:
+            df (dataframe): one row per multiline log, sorted by file name and position in the file
+            df_groups_all_none (dataframe): lines of the files which doesn't contain any timestamp
+        """
+        # The file names are hashed once, the groupings below use their codes, numbered in sorted order
+        file_codes, file_names = pd.factorize(df["file_names"], sort=True)
+        file_codes = pd.Series(file_codes, index=df.index)
+
+        has_epoch = df["epoch"].notna()
+        file_has_epoch = has_epoch.groupby(file_codes).transform("any").astype(bool)
+
+        # Filter out logs of files which doesn't contains any timestamps. THE SPECIAL CASE :)!
+        df_groups_all_none = df[~file_has_epoch].copy()
+
+        # Group logs by file names and epoch timestamps
+        df = df.assign(file_code=file_codes, group=has_epoch.groupby(file_codes).cumsum())
+
+        # Keep only valid logs (where epoch is not None)
+        df = df[file_has_epoch]
+
+        # Aggregate logs based on file names and group number. The texts are joined outside of groupby.agg,
+        # which calls "\n".join through its slow path for every group.
+        grouped = df.groupby(["file_code", "group"])
+        df_agg = grouped.agg({
+            "epoch": "first",
+            "timestamps": "first",
+            "numeric_count": "sum",
+            "total_count": "sum",
+            "token_count": "sum"
+        })
+
+        # Lay out the lines group after group, the groups being numbered in the order of the aggregated rows
+        group_ids = grouped.ngroup().to_numpy()
+        order = np.argsort(group_ids, kind="stable")
+        group_ends = np.cumsum(np.bincount(group_ids, minlength=len(df_agg))).tolist()
+        group_starts = [0] + group_ends[:-1]
+        for position, column in enumerate(["text", "preprocessed_text"]):
+            lines = df[column].to_numpy()[order].tolist()
+            joined = ["\n".join(lines[start:end]) for start, end in zip(group_starts, group_ends)]
+            df_agg.insert(position, column, pd.Series(joined, index=df_agg.index, dtype=object))
+
+        df_agg.insert(0, "file_names", file_names.take(df_agg.index.get_level_values("file_code")))
+        df = df_agg.reset_index(drop=True)
+        return df, df_groups_all_none
+
     def get_time_delta(self, time_range):
         """
         computes time delta for filtering the data
@@ -216,7 +387,7 @@ class Preprocessing:
         For a given list of logs, this fucntion finds the logs which are json objects or multiline logs
         
         Args:
-            logs (list): list of logs
+            logs (iterable): list of logs, or an open file yielding them line by line
         Returns:
             multiline_logs (list): list of multiline logs
             json_logs (list): list of json objects
@@ -224,8 +395,12 @@ class Preprocessing:
         multiline_logs, json_logs = [], []
 
         for log in logs:
+            # Only a line starting with '{' can hold a json object, the others skip the parser and its exception
+            if log.lstrip()[:1] != '{':
+                multiline_logs.append(log)
+                continue
             try:
-                json_object = json.loads(log)
+                json_object = load_json(log)
                 if self.is_valid_json_object(json_object):
                     json_logs.append(json_object)
                 else:
@@ -235,6 +410,26 @@ class Preprocessing:
 
         return multiline_logs, json_logs
 
+    def parallel_map(self, worker_fn, values, chunksize=1024):
+        """
+        Applies a worker function to every value with a pool of processes, each worker loading the rbr model once
+        at start up. Values are sent to the workers in chunks to amortize the inter-process communication.
+        With a single worker, or a single chunk of values, they are processed in the current process instead.
+
+        Args:
+            worker_fn (function): process_value_in_worker, or one of the functions it dispatches to
+            values (list): logs and json objects to process
+            chunksize (int): number of values sent to a worker at once
+        Returns:
+            results (list): result of the worker function for each value, in order
+        """
+        if self.num_workers == 1 or len(values) <= chunksize:
+            initialize_worker(self)
+            return [worker_fn(value) for value in tqdm(values)]
+
+        with ProcessPoolExecutor(max_workers=self.num_workers, initializer=initialize_worker, initargs=(self,)) as executor:
+            return list(tqdm(executor.map(worker_fn, values, chunksize=chunksize), total=len(values)))
+
     def process_files(self, file_list):
         """
         For a given list of file, this fucntion outputs two dataframe one for multiline logs and another for json objects
@@ -251,9 +446,9 @@ class Preprocessing:
         file_names_json = []
         
         for file in tqdm(file_list):
-            with open(file, "r", encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
-                multiline_logs, json_logs = self.detect_jsons(lines)
+            # The lines are streamed from the open file instead of being materialized with readlines()
+            with open(file, "r", encoding='utf-8', errors='ignore', buffering=1 << 20) as f:
+                multiline_logs, json_logs = self.detect_jsons(f)
 
                 logs.extend(multiline_logs)
                 json_logs_list.extend(json_logs)
@@ -274,18 +469,35 @@ class Preprocessing:
         Returns:
             result (json): flattened version of input json
         """
-        stack = [((), json_object)]
+        # The joined key of the parent is carried along, None marks the top level
+        stack = [(None, json_object)]
         result = {}
         while stack:
-            parent_keys, node = stack.pop()
+            parent_key, node = stack.pop()
             for k, v in node.items():
-                new_key = parent_keys + (k,)
+                new_key = k if parent_key is None else parent_key + sep + k
                 if isinstance(v, dict):
                     stack.append((new_key, v))
                 else:
-                    result[sep.join(new_key)] = v
+                    result[new_key] = v
         return result
 
+    def has_top_level_json_fields(self, json_object):
+        """
+        Checks if a json object holds one of the time fields and one of the message fields at its top level,
+        in which case they can be looked up without flattening the object
+        
+        Args:
+            json_object (json): input json object
+        Returns:
+            (bool)
+        """
+        for field_set in (self.json_time_field_set, self.json_message_field_set):
+            fields = field_set & json_object.keys()
+            if not fields or any(isinstance(json_object[field], dict) for field in fields):
+                return False
+        return True
+
     def is_string_numeric(self, NumberString):
         """
         For a given string, this function checks if the string represents a number (int or float)
@@ -335,7 +547,7 @@ class Preprocessing:
         
         else:
             try:
-                ts = god_parse.parse(time_stamp_str).timestamp()
+                ts = parse_timestamp(time_stamp_str).timestamp()
             except Exception as e:
                 return None, None
             else:
@@ -353,18 +565,16 @@ class Preprocessing:
             preprocessed_text(str): preprocessed version of the logline extracted from json object
             digit_count(int): number of digits present in the logline extracted from json object
             alphabet_count + digit_count + 1(int): 1{it is added for +1 smoothing} + total characters (digit+alphabet_count) present in the logline extracted from json object
-            len(log.split(" ")) (int): number of tokens in the logline extracted from json object
+            log.count(" ") + 1 (int): number of tokens in the logline extracted from json object
             Flag (bool): it's True when json is not discarded else it is False
         """
-        check_nested_strings = lambda strings: any(len(string.split('_')) > 1 for string in strings)
-        flatten_flag = check_nested_strings(self.json_time_field) or check_nested_strings(self.json_message_field)
-        if flatten_flag:
+        if self.json_flatten_flag and not self.has_top_level_json_fields(json_obj):
             json_object = self.flatten_json(json_obj)
         else:
             json_object = json_obj
 
         if len(self.json_time_field) > 0:
-            json_time_field_temp = set(self.json_time_field) & set(json_object.keys())
+            json_time_field_temp = self.json_time_field_set & json_object.keys()
             if len(json_time_field_temp) > 0:
                 json_time_field_temp = json_time_field_temp.pop()
             else:
@@ -373,7 +583,7 @@ class Preprocessing:
             return None, None, json_obj, None, None, None, None, True
 
         if len(self.json_message_field) > 0:
-            json_message_field_temp = set(self.json_message_field) & set(json_object.keys())
+            json_message_field_temp = self.json_message_field_set & json_object.keys()
 
             if len(json_message_field_temp) > 0:
                 json_message_field_temp = json_message_field_temp.pop()
@@ -395,7 +605,7 @@ class Preprocessing:
             log_without_ts = log.replace(timestamp, "") if timestamp else log
             alphabet_count, digit_count = self.count_alphabets_and_digits(log_without_ts)
                 
-            return timestamp, ts, log, preprocessed_text, digit_count, alphabet_count + digit_count + 1, len(log.split(" ")), False
+            return timestamp, ts, log, preprocessed_text, digit_count, alphabet_count + digit_count + 1, log.count(" ") + 1, False
         
         return None, None, json_obj, None, None, None, None, True
 
@@ -498,6 +708,50 @@ class Preprocessing:
             
         return datetime_object, future_flag
 
+    def parse_iso_timestamp(self, match, format):
+        """
+        Parses a zero padded ISO 8601 like timestamp with datetime.strptime.
+
+        For these timestamps strptime gives the same naive datetime as dateutil's generic parser, which is much slower.
+
+        Args:
+            match (str): Timestamp matched by a master pattern.
+            format (str): The master format of the pattern.
+
+        Returns:
+            datetime_object (datetime or None): Parsed datetime, None if the fast path does not apply.
+        """
+        if format not in ISO_TIMESTAMP_FORMATS or not self.iso_timestamp_pattern.fullmatch(match):
+            return None
+        try:
+            return datetime.strptime(match, format)
+        except ValueError:
+            return None
+
+    def find_timezone(self, match, timezone_dict):
+        """
+        For a given timestamp string, this function finds the first timezone abbreviation of timezone_dict it contains
+        
+        Args:
+            match (str): timestamp string
+            timezone_dict (dict): dictionary containing timezone info
+        Returns:
+            zone (str or None): timezone abbreviation contained in the timestamp, None if there is none
+        """
+        if timezone_dict is not self.timezone_dict:
+            return next((zone for zone in timezone_dict if zone in match), None)
+
+        # The abbreviations are made of letters, so only the substrings of the letter runs can be one of them
+        found_zones = set()
+        for run in self.letters_pattern.findall(match):
+            for length in self.timezone_lengths:
+                for start in range(len(run) - length + 1):
+                    if run[start:start + length] in self.timezone_index:
+                        found_zones.add(run[start:start + length])
+        if not found_zones:
+            return None
+        return min(found_zones, key=self.timezone_index.__getitem__)
+
     def master_datetime_extractor(self, log, timezone_dict, master_timestamp_list, master_format_list):
         """
         Extracts datetime from log using multiple patterns and formats.
@@ -515,8 +769,13 @@ class Preprocessing:
         """
 
         future_flag = False
+
+        # Skip the patterns that need a digit when the line has none
+        if master_timestamp_list is self.master_timestamp_list and not self.digit_pattern.search(log):
+            master_timestamp_list, master_format_list = self.digitless_timestamp_list, self.digitless_format_list
+
         for pattern, format in zip(master_timestamp_list, master_format_list):
-            match_original = re.search(pattern, log)
+            match_original = pattern.search(log)
             if match_original:
                 start = match_original.start()
                 end = match_original.end()
@@ -556,27 +815,28 @@ class Preprocessing:
                     date_obj, future_flag = self.day_of_the_year(match_original)
                     return match_output, date_obj.timestamp(), future_flag
 
-                try:
-                    parsed_date = god_parse.parse(match, tzinfos=timezone_dict)
-                except:
-                    found_zone = False
-                    for z, timezone in timezone_dict.items():
-                        if z in match:
+                parsed_date = self.parse_iso_timestamp(match, format)
+                if parsed_date is None:
+                    try:
+                        parsed_date = parse_timestamp(match, tzinfos=timezone_dict)
+                    except:
+                        found_zone = False
+                        z = self.find_timezone(match, timezone_dict)
+                        if z is not None:
                             match = match.replace(z, "").strip()
-                            tz = pytz.timezone(timezone)
+                            tz = pytz.timezone(timezone_dict[z])
                             found_zone = True
-                            break
                     
-                    match = re.sub(r"[A-Za-z]+$", "", match).strip()                  
-                    try:
-                        parsed_date = datetime.strptime(match, format)
-                        if found_zone:
-                            parsed_date = tz.localize(parsed_date)
-                        else:
-                            gmt = pytz.timezone('GMT')
-                            parsed_date = parsed_date.astimezone(gmt)
-                    except Exception:
-                        continue
+                        match = self.trailing_letters_pattern.sub("", match).strip()
+                        try:
+                            parsed_date = datetime.strptime(match, format)
+                            if found_zone:
+                                parsed_date = tz.localize(parsed_date)
+                            else:
+                                gmt = pytz.timezone('GMT')
+                                parsed_date = parsed_date.astimezone(gmt)
+                        except Exception:
+                            continue
                 if parsed_date is None:
                     return match_output, None, False
                 
@@ -600,11 +860,11 @@ class Preprocessing:
         """
         current_datetime = datetime.now()
         current_day = current_datetime.day
-        result = json.loads(rbr.process(log, "en"))
+        result = load_json(rbr.process(log, "en"))
         future_flag = False
         try:
             match = result['annotations']['DateTimeOutput'][0]['span']['text']
-            parsed_date = god_parse.parse(match, tzinfos=timezone_dict)
+            parsed_date = parse_timestamp(match, tzinfos=timezone_dict)
 
             if parsed_date.hour == 0 and parsed_date.minute == 0 and parsed_date.second == 0:
                 return None, None, future_flag
@@ -633,22 +893,38 @@ class Preprocessing:
             timestamp (string): time stamp string extracted from the line. It can be None if no timestamp is present in the line
             ts (int): epoch of the time stamp string extracted the line or csv column
         """
+        # Identical lines are frequent, e.g. in stack traces, so the results with the default lists are cached per line.
+        # Timestamps without a date are parsed relative to the current day, so the cache only lives for a day.
+        use_cache = timezone_dict is self.timezone_dict and master_timestamp_list is self.master_timestamp_list
+        if use_cache:
+            today = date.today().toordinal()
+            if today != self.extract_ts_cache_day or len(self.extract_ts_cache) >= EXTRACT_TS_CACHE_SIZE:
+                self.extract_ts_cache.clear()
+                self.extract_ts_cache_day = today
+            cached = self.extract_ts_cache.get(log)
+            if cached is not None:
+                return cached
+
         ts = None
         future_flag = False
         try:
             timestamp, ts, future_flag = self.master_datetime_extractor(log, timezone_dict, master_timestamp_list, master_format_list)
             if not ts:
-                timestamp, ts, future_flag = self.aql_datetime_extractor(log, rbr, timezone_dict)
+                # Without digits there is no time of day in the line, which aql_datetime_extractor requires
+                if self.digit_pattern.search(log):
+                    timestamp, ts, future_flag = self.aql_datetime_extractor(log, rbr, timezone_dict)
+                else:
+                    timestamp, ts, future_flag = None, None, False
             
-            if not future_flag:
-                return timestamp, ts
-
             # TODO: Handle future flag case
-            return timestamp, ts
         except Exception as e:
             print(f"Error extracting timestamp \nLogline: {log} \nError: {e}")
             return None, None
 
+        if use_cache:
+            self.extract_ts_cache[log] = (timestamp, ts)
+        return timestamp, ts
+
     def process_fn(self, log, timezone_dict, master_timestamp_list, master_format_list):
         """
         This function processes one line of multiline log at a time:  extracts timestamp present in the logline if possible
@@ -664,10 +940,11 @@ class Preprocessing:
             preprocessed_text(str): preprocessed version of the logline extracted the line
             digit_count(int): number of digits present in the logline extracted the line
             alphabet_count + digit_count + 1(int): 1{it is added for +1 smoothing} + total characters (digit+alphabet_count) present in the logline extracted the line
-            len(log.split(" ")) (int): number of tokens in the logline extracted the line
+            log.count(" ") + 1 (int): number of tokens in the logline extracted the line
         """
-        # Ensure initialization only happens once per worker
-        initialize_once()
+        # Ensure initialization only happens once per worker, the pool workers are already initialized at start up
+        if not is_initialized:
+            initialize_once()
 
         timestamp, ts = self.extract_ts(log, rbr, timezone_dict, master_timestamp_list, master_format_list)
         log = log.encode('ascii', 'ignore').decode('ascii')
@@ -678,7 +955,7 @@ class Preprocessing:
         log_without_ts = log.replace(timestamp, "") if timestamp else log
         alphabet_count, digit_count = self.count_alphabets_and_digits(log_without_ts)
             
-        return timestamp, ts, log, preprocessed_text, digit_count, alphabet_count + digit_count + 1, len(log.split(" "))
+        return timestamp, ts, log, preprocessed_text, digit_count, alphabet_count + digit_count + 1, log.count(" ") + 1
 
     def preprocess(self, input_files, time_range, output_dir, process_all_files, process_log_files, process_txt_files):
         """
@@ -707,8 +984,7 @@ class Preprocessing:
             
             3. Process log files:
                 - Creates two dataframes by reading all the input files. One df is for json objects found in the file and another one is for multiline logs
-                - process json dataframe in parallel to extract timestamp from logline.
-                - process multiline dataframe in parallel to extract timestamp from logline.
+                - process json objects and multiline logs in a single parallel pass to extract timestamp from logline.
             
             4. Preprocess and aggregate logs:
                 - Group logs based on their file names and timestamps.
@@ -750,23 +1026,28 @@ class Preprocessing:
         files_to_process = []  # List to store files that will be processed
         ignored_list = []  # List to store ignored files (e.g., archives)
 
-        # Iterate through each file in input_files
-        for file_ in input_files:
+        # Iterate through each unique file in input_files, keeping the order given by the user
+        for file_ in dict.fromkeys(input_files):
+
+            # Check if it's an archive only once, patoolib may spawn a subprocess to inspect the file.
+            # Common archive extensions are recognized without it, unless the path is a directory.
+            is_dir = os.path.isdir(file_)
+            is_archive = (not is_dir and Path(file_).suffix in ARCHIVE_EXTENSIONS) or patoolib.is_archive(file_)
 
             # Print file information and check if it's an archive or directory
-            print(file_, f"patoolib.is_archive(file_): {patoolib.is_archive(file_)}")
-            print(file_, f"os.path.isdir(file_): {os.path.isdir(file_)}")
+            print(file_, f"is_archive: {is_archive}")
+            print(file_, f"os.path.isdir(file_): {is_dir}")
 
             extensions = Path(file_).suffixes  # Get file extensions
             print(f"'.csv' in extensions: {'.csv' in extensions}")
             print(f"'.xml' in extensions: {'.xml' in extensions}")
 
             # Skip archives or irrelevant file types
-            if patoolib.is_archive(file_):
+            if is_archive:
                 ignored_list.append(file_)
 
             # Handle directories by finding log files
-            elif os.path.isdir(file_):
+            elif is_dir:
                 all_files_in_dir = [fp for fp in glob.glob(os.path.join(file_, '**'), recursive=True) if not os.path.isdir(fp)]
 
                 log_files, txt_files = [], []
@@ -779,7 +1060,8 @@ class Preprocessing:
                         log_files = [file for file in all_files_in_dir if self.pattern_log.match(os.path.basename(file))]
 
                     files_to_process.extend(log_files + txt_files)
-                    ignored_list.extend([fp for fp in all_files_in_dir if fp not in (log_files + txt_files)])
+                    kept_files = set(log_files).union(txt_files)
+                    ignored_list.extend([fp for fp in all_files_in_dir if fp not in kept_files])
 
             # Handle individual files based on their extensions
             elif ('.xml' in extensions) or (self.is_csv_present == "false" and ('.csv' in extensions or '.xlsx' in extensions)) or ('.tsv' in extensions):
@@ -805,10 +1087,18 @@ class Preprocessing:
         # Process the log files and get dataframes for logs and JSON objects
         df, df_json = self.process_files(files_to_process)
 
-        # Process JSON data in parallel
         df_json = df_json.dropna()
+
+        # Process JSON data and multiline log data in a single parallel pass, so that the pool of workers is started once
+        print(f"Debug mode is set to: {self.debug_mode}")
+        print(f"Starting log processing with {self.num_workers} workers")
+        json_values = df_json['text'].tolist()
+        results = self.parallel_map(process_value_in_worker, json_values + df['text'].tolist())
+        json_results, log_results = results[:len(json_values)], results[len(json_values):]
+
         if len(df_json) > 0:
-            df_json[['timestamps', 'epoch', 'text', 'preprocessed_text', 'numeric_count', "total_count", "token_count", "discarded"]] = df_json['text'].parallel_apply(lambda json_obj: pd.Series(self.process_fn_json(json_obj)))
+            json_columns = ['timestamps', 'epoch', 'text', 'preprocessed_text', 'numeric_count', "total_count", "token_count", "discarded"]
+            df_json[json_columns] = pd.DataFrame(json_results, index=df_json.index, columns=json_columns)
         else:
             df_json = pd.DataFrame({
                 'timestamps': [],
@@ -824,17 +1114,15 @@ class Preprocessing:
         if (self.debug_mode == "true"):
             df_json_discarded = df_json[df_json["discarded"] == True]
             df_json_discarded = df_json_discarded['text'] # Extract discarded JSON objects
-            with open(os.path.join(output_dir, "developer_debug_files", "json_discarded.log"), 'w') as log_file:
-                for line in df_json_discarded:
-                    log_file.write(f"{line}\n")  # Write each line of the 'text' column to the log file
+            with open(os.path.join(output_dir, "developer_debug_files", "json_discarded.log"), 'w', buffering=1 << 20) as log_file:
+                # Write each line of the 'text' column to the log file, through a single call to the buffered writer
+                log_file.writelines(f"{line}\n" for line in df_json_discarded)
         df_json = df_json[df_json["discarded"] == False]
         df_json = df_json.drop(columns=["discarded"])
 
-        print(f"Debug mode is set to: {self.debug_mode}")
-        # Process multiline log data in parallel
-        print("Starting pandarallel for log processing")
         if len(df) > 0:
-            df[['timestamps', 'epoch', 'text', 'preprocessed_text', 'numeric_count', "total_count", "token_count"]] = df['text'].parallel_apply(lambda log: pd.Series(self.process_fn(log, self.timezone_dict, self.master_timestamp_list, self.master_format_list)))
+            log_columns = ['timestamps', 'epoch', 'text', 'preprocessed_text', 'numeric_count', "total_count", "token_count"]
+            df[log_columns] = pd.DataFrame(log_results, index=df.index, columns=log_columns)
         else:
             df = pd.DataFrame({
                 'file_names': [],
@@ -851,55 +1139,36 @@ class Preprocessing:
             df_none_logs = df[df["epoch"].isna()]  # Filter rows where 'epoch' is None (or NaN)
             text_column = df_none_logs['text']  # Extract the 'text' column
             # Write the 'text' column to the .log file
-            with open(os.path.join(output_dir, "developer_debug_files", "none_logs.log"), 'w') as log_file:
-                for line in text_column:
-                    log_file.write(f"{line}\n")  # Write each line of the 'text' column to the log file
+            with open(os.path.join(output_dir, "developer_debug_files", "none_logs.log"), 'w', buffering=1 << 20) as log_file:
+                # Write each line of the 'text' column to the log file, through a single call to the buffered writer
+                log_file.writelines(f"{line}\n" for line in text_column)
         
-        # Filter out logs of files which doesn't contains any timestamps. THE SPECIAL CASE :)!
-        df_groups_all_none = df.groupby("file_names").filter(lambda x: x['epoch'].isna().all())
-
-        # Group logs by file names and epoch timestamps
-        df["group"] = df.groupby("file_names")["epoch"].transform(lambda x: (~x.isna()).cumsum())
-
-        # Keep only valid logs (where epoch is not None)
-        df = df.loc[~df.index.isin(df_groups_all_none.index)]
-
-        # Aggregate logs based on file names and group number
-        df = df.groupby(["file_names", "group"]).agg({
-            "text": "\n".join,
-            "preprocessed_text": "\n".join,
-            "epoch": "first",
-            "timestamps": "first",
-            "numeric_count": "sum",
-            "total_count": "sum",
-            "token_count": "sum"
-        }).reset_index()
-
-        df = df.drop(columns=["group"])
-
-        # Combine processed logs and JSON data
-        df = pd.concat([df, df_json], axis=0, ignore_index=True)
+        # Group the lines of multiline logs, and set aside the files without any timestamp
+        df, df_groups_all_none = self.group_multiline_logs(df)
 
-        if len(df) == 0:
-            self.df = df
+        if len(df) + len(df_json) == 0:
+            self.df = pd.concat([df, df_json], axis=0, ignore_index=True)
             print("PREPROCESSING ERROR: No log lines extracted from the input.")
             return
 
-        # Calculate the ratio of numeric to total counts and filter based on threshold
-        df['ratio'] = df['numeric_count'] / df['total_count']
-        df = df[df["ratio"] < 0.5]
-        df = df.drop(columns=["ratio"])
+        # Filter out the logs whose ratio of numeric to total counts is above the threshold of 0.5. The ratio is compared
+        # without a division, total_count is at least 1 thanks to its +1 smoothing. The processed logs and the JSON data
+        # are filtered on their own, so that they are combined with the files without timestamps by a single concat below
+        df = df[df['numeric_count'] * 2 < df['total_count']]
+        df_json = df_json[df_json['numeric_count'] * 2 < df_json['total_count']]
 
-        # Determine the maximum epoch value and adjust timestamps
-        max_epoch = df['epoch'].max()
+        # Determine the maximum epoch value and adjust timestamps, fmax skips the NaN of an empty frame
+        max_epoch = np.fmax(df['epoch'].max(), df_json['epoch'].max())
         if math.isnan(max_epoch):
             max_epoch = datetime.now().timestamp()
 
         timestr = datetime.fromtimestamp(max_epoch).strftime('%Y-%m-%d %H:%M:%S')
-        df_groups_all_none["epoch"] = [max_epoch]*len(df_groups_all_none)
-        df_groups_all_none["timestamps"] = [timestr]*len(df_groups_all_none)
+        # The scalars are broadcast by pandas, without building a list of repeated values
+        df_groups_all_none["epoch"] = max_epoch
+        df_groups_all_none["timestamps"] = timestr
 
-        df = pd.concat([df, df_groups_all_none], ignore_index=True)
+        # Combine processed logs, JSON data and the files without timestamps
+        df = pd.concat([df, df_json, df_groups_all_none], axis=0, ignore_index=True)
 
         # Apply time range filtering if needed
         print(f"Time range provided by user: {time_range}")
@@ -921,18 +1190,20 @@ class Preprocessing:
 
         if np.isnan(std_dev) or std_dev == 0:
             # No variability -> No need for z-score truncation
-            df['z_score'] = 0
-            df['truncated_token_count'] = df['token_count']
             df['truncated_log'] = df['text']
+            num_truncated = 0
         else:
             z_threshold = self.z_threshold
             upper_bound = int(mean + z_threshold * std_dev)
 
-            df['z_score'] = (df['token_count'] - mean) / std_dev
-            df['truncated_token_count'] = np.where(df['z_score'] > z_threshold, upper_bound, df['token_count'])
-            df['truncated_log'] = df.parallel_apply(
-                lambda row: row['text'][:upper_bound] if row['token_count'] > upper_bound else row['text'], axis=1
-            )
+            # A z-score above the threshold is the same as a token count above the upper bound, as the token counts
+            # are integers. The z-scores are not computed, a single mask decides which logs are truncated.
+            truncate_mask = df['token_count'].to_numpy() > upper_bound
+            num_truncated = int(truncate_mask.sum())
+            # Only the logs above the upper bound are sliced, the others are kept as they are
+            truncated_log = df['text'].to_numpy(dtype=object, copy=True)
+            truncated_log[truncate_mask] = [text[:upper_bound] for text in truncated_log[truncate_mask]]
+            df['truncated_log'] = truncated_log
 
 
         # # Plot histograms of original and truncated token counts
@@ -948,7 +1219,6 @@ class Preprocessing:
         # plt.xscale('log')
         # plt.legend()
 
-        num_truncated = (df['token_count'] != df['truncated_token_count']).sum()
         # Log the number of truncated logs
         print(f"Number of logs affected by truncation: {num_truncated}")
 
@@ -972,7 +1242,7 @@ class Preprocessing:
 
 
         # Clean up the final DataFrame
-        df = df.drop(columns=["total_count", "numeric_count", "token_count", "truncated_token_count", "z_score"])
+        df = df.drop(columns=["total_count", "numeric_count", "token_count"])
         df = df.dropna()
 
         print("Total log lines:", len(df))
@@ -56,6 +56,13 @@ class MockModel:
         
         # Compile patterns for better performance
         self.compiled_patterns = [re.compile(pattern) for pattern in self.datetime_patterns]
+        
+        # Patterns that can match text without a colon, the others are skipped for such text.
+        # The colons of the patterns above are all mandatory, "(?:" groups aside.
+        self.colonless_patterns = [pattern for pattern in self.compiled_patterns if ':' not in pattern.pattern.replace('(?:', '')]
+
+        # Pattern of the hexadecimal strings that are not taken as timestamps, unless they have 8 digits
+        self.hexadecimal_pattern = re.compile(r'^[0-9A-Fa-f]+$')
     
     def _load_manifest(self) -> Dict[str, Any]:
         """Load manifest configuration from JSON file."""
@@ -116,7 +123,8 @@ class MockModel:
         """
         matches = []
         
-        for pattern in self.compiled_patterns:
+        patterns = self.compiled_patterns if ':' in text else self.colonless_patterns
+        for pattern in patterns:
             for match in pattern.finditer(text):
                 match_text = match.group().strip()
                 start_pos = match.start()
@@ -160,7 +168,7 @@ class MockModel:
                 return False
         
         # Skip hexadecimal strings that might be IDs rather than timestamps
-        if re.match(r'^[0-9A-Fa-f]+$', text) and len(text) != 8:
+        if self.hexadecimal_pattern.match(text) and len(text) != 8:
             return False
         
         return True
@@ -181,28 +189,22 @@ class MockModel:
         # Sort by start position
         matches.sort(key=lambda x: x[1])
         
+        # The kept matches never overlap and are sorted by start position, so a new match
+        # can only overlap the last kept one
         deduplicated = []
-        for match_text, start_pos, end_pos in matches:
-            # Check if this match overlaps with any existing match
-            overlaps = False
-            for existing_match in deduplicated:
-                existing_start = existing_match[1]
-                existing_end = existing_match[2]
+        for match in matches:
+            match_text, start_pos, end_pos = match
+            if deduplicated:
+                last_text, last_start, last_end = deduplicated[-1]
                 
                 # Check for overlap
-                if not (end_pos <= existing_start or start_pos >= existing_end):
+                if not (end_pos <= last_start or start_pos >= last_end):
                     # There's an overlap, keep the longer match
-                    if len(match_text) > len(existing_match[0]):
-                        # Remove the existing match and add this one
-                        deduplicated.remove(existing_match)
-                        break
-                    else:
-                        # Keep the existing match, skip this one
-                        overlaps = True
-                        break
+                    if len(match_text) > len(last_text):
+                        deduplicated[-1] = match
+                    continue
             
-            if not overlaps:
-                deduplicated.append((match_text, start_pos, end_pos))
+            deduplicated.append(match)
         
         return deduplicated
 
@@ -1,45 +1,55 @@
 import unittest
 import os
-import json
 import warnings
 import pandas as pd
 
-from .preprocessing import Preprocessing, pyrbras
+from . import preprocessing
+from .preprocessing import Preprocessing
 warnings.filterwarnings("ignore", category=DeprecationWarning, module=".*")
+
+# The test cases are located next to this file, whatever the working directory of the test run
+TEST_CASES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.csv")
+
+def extract_ts_in_worker(log_line):
+    """Extracts the timestamp of a test log in a worker of Preprocessing.parallel_map, which loads the rbr model."""
+    preprocessor = preprocessing.worker_preprocessing
+    timestamp, ts = preprocessor.extract_ts(
+        log_line,
+        preprocessing.rbr,
+        preprocessor.timezone_dict,
+        preprocessor.master_timestamp_list,
+        preprocessor.master_format_list
+    )
+    return timestamp, ts
+
 class TestExtractTS(unittest.TestCase):
     
-    def setUp(self):
-        """Set up test fixtures before each test method."""
-        self.preprocessor = Preprocessing(debug_mode=False)
-        self.rbr = pyrbras.load_model(os.path.join(os.path.dirname(__file__), 'model', 'manifest.json'))
-        with open(os.path.join(os.path.dirname(__file__), 'timezones.json'), 'r') as f:
-            self.timezone_dict = json.load(f)
-        self.master_timestamp_list = self.preprocessor.master_timestamp_list
-        self.master_format_list = self.preprocessor.master_format_list
-        self.df = pd.read_csv("./test.csv")  # Ensure test_data.csv is the correct path
-    
-    def extract_ts(self, log_line):
-        timestamp, ts = self.preprocessor.extract_ts(
-            log_line,
-            self.rbr,
-            self.timezone_dict,
-            self.master_timestamp_list,
-            self.master_format_list
-        )
-        return timestamp, ts
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures once for all the test methods, they are only read by the tests."""
+        cls.preprocessor = Preprocessing(debug_mode=False)
+        cls.df = pd.read_csv(TEST_CASES_FILE, dtype={"identified_ts": "float64"})
+        # The columns are converted once, instead of building a Series for every row
+        cls.logs = cls.df["test_logs"].to_numpy()
+        cls.expected_timestamps = cls.df["extracted_ts"].astype(str).to_numpy()
+        cls.expected_ts = cls.df["identified_ts"].to_numpy()
     
     def test_extract_ts_cases(self):
         """Run extract_ts on all test cases from CSV and compare results."""
-        passed, failed = 0, 0
-        for _, row in self.df.iterrows():
-            extracted_timestamp, extracted_ts = self.extract_ts(row["test_logs"])
-            expected_timestamp = str(row["extracted_ts"])
-            expected_ts = float(row["identified_ts"])
+        passed, failures = 0, []
+        # The test cases are independent, they are spread over the workers of the preprocessing pool
+        results = self.preprocessor.parallel_map(extract_ts_in_worker, self.logs.tolist())
+        for log, (extracted_timestamp, extracted_ts), expected_timestamp, expected_ts in zip(
+            self.logs, results, self.expected_timestamps, self.expected_ts
+        ):
             if extracted_timestamp == expected_timestamp and extracted_ts == expected_ts:
                 passed += 1
             else:
-                failed += 1
-                print(f"Failed for log: {row['test_logs']}\n Extracted: ({extracted_timestamp}, {extracted_ts}), Expected: ({expected_timestamp}, {expected_ts})\n")
+                failures.append(f"Failed for log: {log}\n Extracted: ({extracted_timestamp}, {extracted_ts}), Expected: ({expected_timestamp}, {expected_ts})\n")
+        # The failures are reported at once, after all the test cases have run
+        failed = len(failures)
+        if failures:
+            print(*failures, sep="\n")
         print(f"Total Passed: {passed}, Total Failed: {failed}")
         assert failed == 0, f"Some test cases failed: {failed}"
 
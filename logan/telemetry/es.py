@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch
 
@@ -12,35 +13,37 @@ def get_elasticsearch_config():
         'password': os.getenv('ELASTICSEARCH_PASSWORD'),
     }
 
+# The environment and the index names are looked up once, the variables are set when the process starts
+@lru_cache(maxsize=1)
 def get_environment():
     return os.getenv('ENVIRONMENT', 'LOCAL')
 
+@lru_cache(maxsize=1)
 def get_stats_index():
     env = get_environment()
     index = os.getenv(f'ES_STATS_{env}_INDEX', 'stats-local')
     return index
 
 
+@lru_cache(maxsize=1)
 def get_feedback_index():
     env = get_environment()
     index = os.getenv(f'ES_FEEDBACK_{env}_INDEX', 'feedback-local')
     return index
 
+@lru_cache(maxsize=1)
 def get_es_client():
+    # The client is built once, later calls reuse it along with its pool of connections
     config = get_elasticsearch_config()
 
+    # The credentials are given to the client directly, a copy of it with the same .options() is not needed
     es = Elasticsearch(
         config['host'],
         basic_auth=(config['username'], config['password']),
         verify_certs=False
     )
 
-    #  Authenticate via the .options() method:
-    ecs = es.options(
-        basic_auth=(config['username'], config['password'])
-    )
-
-    return ecs
+    return es
 
 
 def create_document(index, document):
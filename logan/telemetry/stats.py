@@ -1,31 +1,43 @@
 import os
 import json
-from glob import glob
 from datetime import datetime
 from argparse import ArgumentParser
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from es import get_stats_index, create_document
 from utils import get_product_name_from_key, get_case_number
 
+def load_metrics_file(fp):
+    with open(fp, 'rb') as reader:
+        content = reader.read()
+    # orjson is considerably faster than json, the documents it rejects, e.g. with NaN values, are decoded with json
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(content)
+
 def generate_stats_doc(dir, product_key, xml_file, stage):
-    all_metrics_fp = glob(os.path.join(dir, "**.json"))
+    # The directory is listed once, skipping the hidden files as glob did
+    with os.scandir(dir) as entries:
+        all_metrics_fp = [entry.path for entry in entries if entry.name.endswith(".json") and not entry.name.startswith(".")]
     doc = {}
     
     for fp in all_metrics_fp:
-        with open(fp, 'r') as reader:
-            tmp = json.load(reader)
-        
-        doc.update(tmp)
-    
-    total_processing_time_ms = 0
-    for key, value in doc.items():
-        if key.endswith("time_ms"):
-            total_processing_time_ms += float(value)
+        doc.update(load_metrics_file(fp))
     
-    doc['total_processing_time_ms'] = total_processing_time_ms
+    doc['total_processing_time_ms'] = sum(float(value) for key, value in doc.items() if key.endswith("time_ms"))
 
     doc['case_number'] = get_case_number(dir)
-    doc['failed_stage'] = None if doc['success'] else stage
+    # A run without any success metric has no recorded failure, it is reported instead of raising a KeyError
+    success = doc.get('success', True)
+    doc['success'] = success
+    doc['failed_stage'] = None if success else stage
     doc['product_name'] = get_product_name_from_key(product_key, xml_file)
     doc['timestamp_triggered'] = datetime.now().isoformat()
     
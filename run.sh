@@ -50,6 +50,12 @@ LOGAN_PROCESS_LOG_FILES="${LOGAN_PROCESS_LOG_FILES:-true}"
 # Process .txt files from directories
 LOGAN_PROCESS_TXT_FILES="${LOGAN_PROCESS_TXT_FILES:-false}"
 
+# Number of processes used for preprocessing, empty for the number of CPUs
+LOGAN_PREPROCESSING_WORKERS="${LOGAN_PREPROCESSING_WORKERS:-}"
+
+# Number of processes used for Drain3 template mining
+LOGAN_DRAIN_WORKERS="${LOGAN_DRAIN_WORKERS:-1}"
+
 # Clean up output directory before running
 LOGAN_CLEAN_UP="${LOGAN_CLEAN_UP:-false}"
 
@@ -97,6 +103,8 @@ print_config() {
     echo "  LOGAN_PROCESS_ALL_FILES: ${LOGAN_PROCESS_ALL_FILES}"
     echo "  LOGAN_PROCESS_LOG_FILES: ${LOGAN_PROCESS_LOG_FILES}"
     echo "  LOGAN_PROCESS_TXT_FILES: ${LOGAN_PROCESS_TXT_FILES}"
+    echo "  LOGAN_PREPROCESSING_WORKERS: ${LOGAN_PREPROCESSING_WORKERS}"
+    echo "  LOGAN_DRAIN_WORKERS:     ${LOGAN_DRAIN_WORKERS}"
     echo "  LOGAN_CLEAN_UP:          ${LOGAN_CLEAN_UP}"
     echo "  LOGAN_VIEW_PORT:         ${LOGAN_VIEW_PORT}"
     echo ""
@@ -178,6 +186,14 @@ run_analyze() {
         fi
     fi
 
+    # Add preprocessing workers
+    if [ -n "${LOGAN_PREPROCESSING_WORKERS}" ]; then
+        CMD="$CMD --preprocessing-workers ${LOGAN_PREPROCESSING_WORKERS}"
+    fi
+
+    # Add drain workers
+    CMD="$CMD --drain-workers ${LOGAN_DRAIN_WORKERS}"
+
     # Add clean up flag
     if [ "${LOGAN_CLEAN_UP,,}" = "true" ]; then
         CMD="$CMD --clean-up"